@@ -0,0 +1,63 @@
+#!/bin/bash
+# fails if the render client doesn't fall back to rendering in process when the server can't be used
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+PYTHON="${PYTHON:-python3}"
+WORK_DIR="$(mktemp -d)"
+trap 'rm -rf "$WORK_DIR"' EXIT
+
+cd "$WORK_DIR" && \
+GITLAB_CR_REGISTRY=registry.gitlab.com/haondt/cicd/registry \
+DOCKER_HUB_REPOSITORY=haumea \
+CI_COMMIT_BRANCH=main \
+CI_COMMIT_TAG=v1.2.3 \
+ROOT_PIPELINE_SOURCE=push \
+CI_PIPELINE_SOURCE=push \
+CI_COMMIT_SHORT_SHA=6a47b57f \
+DEFAULT_ARTIFACT_EXPIRY="1 day" \
+PYTHONPATH="$SCRIPT_DIR/../../scripts" "$PYTHON" - "$SCRIPT_DIR/../../templates" <<'EOF'
+from hephaestus.benchmark import python_build_task
+import os, socket, subprocess, sys, threading, yaml
+
+templates = sys.argv[1]
+with open('pipeline.yml', 'w') as f:
+    yaml.dump({ 'tasks': [python_build_task(0)] }, f)
+
+def render(*args):
+    command = [sys.executable, '-m', 'hephaestus.render_client', '0', 'python-build', '--templates', templates, '-f', 'pipeline.yml', *args]
+    return subprocess.run(command, capture_output=True, text=True, timeout=60, env={ k: v for k, v in os.environ.items() if k != 'HEPHAESTUS_SOCKET' })
+
+def closes_without_reply():
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.bind('closing.sock')
+    s.listen()
+    def serve():
+        connection, _ = s.accept()
+        connection.close()
+    threading.Thread(target=serve, daemon=True).start()
+    return 'closing.sock'
+
+def not_permitted():
+    # bound but not listening, refused when running as root and not permitted otherwise
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.bind('denied.sock')
+    os.chmod('denied.sock', 0)
+    return 'denied.sock'
+
+def path_too_long():
+    return os.path.join(os.getcwd(), 'x' * 200 + '.sock')
+
+expected = render()
+if expected.returncode != 0:
+    print(f'rendering in process failed: {expected.stderr}')
+    sys.exit(1)
+
+status = 0
+for case in [closes_without_reply, not_permitted, path_too_long]:
+    result = render('--socket', case())
+    if result.returncode != 0 or result.stdout != expected.stdout or 'rendering in process' not in result.stderr:
+        print(f'{case.__name__}: failed\n{result.stderr}')
+        status = 1
+    else:
+        print(f'{case.__name__}: ok')
+sys.exit(status)
+EOF
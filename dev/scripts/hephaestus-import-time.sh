@@ -0,0 +1,21 @@
+#!/bin/bash
+# fails if cold importing any hephaestus entry point takes longer than the budget
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+PYTHON="${PYTHON:-python3}"
+IMPORT_TIME_BUDGET_US="${IMPORT_TIME_BUDGET_US:-250000}"
+
+status=0
+for module in hephaestus.generate hephaestus.render_template; do
+    total=$(PYTHONPATH="$SCRIPT_DIR/../../scripts" "$PYTHON" -X importtime -c "import $module" 2>&1 \
+        | awk -F'|' -v module="$module" '{ gsub(/ /, "", $3) } $3 == module { gsub(/ /, "", $2); print $2 }')
+    if [ -z "$total" ]; then
+        echo "$module: failed to import"
+        status=1
+    elif [ "$total" -gt "$IMPORT_TIME_BUDGET_US" ]; then
+        echo "$module: ${total}us exceeds budget of ${IMPORT_TIME_BUDGET_US}us"
+        status=1
+    else
+        echo "$module: ${total}us"
+    fi
+done
+exit $status
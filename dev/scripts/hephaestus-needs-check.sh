@@ -0,0 +1,45 @@
+#!/bin/bash
+# fails if `--needs stageless` drops artifacts a job downloads when it runs by stage
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+PYTHON="${PYTHON:-python3}"
+
+PYTHONPATH="$SCRIPT_DIR/../../scripts" "$PYTHON" - <<'EOF'
+from hephaestus.needs import apply_needs_mode, max_needs
+import sys
+
+def pipeline(**jobs):
+    return { 'stages': ['build', 'pack', 'push'], **jobs }
+
+manual_pack = { 'stage': 'pack', 'when': 'manual', 'script': ['make pack'], 'artifacts': { 'paths': ['out/'] } }
+other = { 'stage': 'build', 'script': ['make'] }
+
+def manual_producer_by_script():
+    output = apply_needs_mode(pipeline(pack=manual_pack, other=other, push={ 'stage': 'push', 'script': ['cp out/a b'] }), 'stageless', header := {})
+    return 'needs' not in output['push'] and 'push' in header.get('stage ordered jobs', '')
+
+def manual_producer_by_dependencies():
+    push = { 'stage': 'push', 'script': ['./release'], 'dependencies': ['pack'] }
+    output = apply_needs_mode(pipeline(pack=manual_pack, other=other, push=push), 'stageless', header := {})
+    return 'needs' not in output['push'] and output['push']['dependencies'] == ['pack'] and 'push' in header.get('stage ordered jobs', '')
+
+def manual_producer_unused():
+    output = apply_needs_mode(pipeline(pack=manual_pack, other=other, push={ 'stage': 'push', 'script': ['echo'] }), 'stageless', {})
+    return output['push'].get('needs') == [{ 'job': 'other', 'artifacts': False }]
+
+def producer_used():
+    build = { 'stage': 'build', 'script': ['make'], 'artifacts': { 'paths': ['dist/'] } }
+    output = apply_needs_mode(pipeline(build=build, other=other, push={ 'stage': 'push', 'script': ['ls dist'] }), 'stageless', {})
+    return { 'job': 'build', 'artifacts': True } in output['push'].get('needs', [])
+
+def over_needs_limit():
+    jobs = { f'build-{i}': other for i in range(max_needs + 1) }
+    output = apply_needs_mode(pipeline(**jobs, push={ 'stage': 'push', 'script': ['echo'] }), 'stageless', header := {})
+    return 'needs' not in output['push'] and 'push' in header.get('stage ordered jobs', '')
+
+status = 0
+for check in [manual_producer_by_script, manual_producer_by_dependencies, manual_producer_unused, producer_used, over_needs_limit]:
+    ok = check()
+    print(f'{check.__name__}: {"ok" if ok else "failed"}')
+    status |= 0 if ok else 1
+sys.exit(status)
+EOF
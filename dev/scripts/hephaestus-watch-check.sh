@@ -0,0 +1,45 @@
+#!/bin/bash
+# fails if the watch output drifts from a fresh generate after a task in the pipeline file is edited
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+PYTHON="${PYTHON:-python3}"
+WORK_DIR="$(mktemp -d)"
+trap 'rm -rf "$WORK_DIR"' EXIT
+
+cd "$WORK_DIR" && \
+GITLAB_CR_REGISTRY=registry.gitlab.com/haondt/cicd/registry \
+DOCKER_HUB_REPOSITORY=haumea \
+CI_COMMIT_BRANCH=main \
+CI_COMMIT_TAG=v1.2.3 \
+ROOT_PIPELINE_SOURCE=push \
+CI_PIPELINE_SOURCE=push \
+CI_COMMIT_SHORT_SHA=6a47b57f \
+DEFAULT_ARTIFACT_EXPIRY="1 day" \
+PYTHONPATH="$SCRIPT_DIR/../../scripts" "$PYTHON" - "$SCRIPT_DIR/../../templates" <<'EOF'
+from hephaestus.benchmark import docker_build_task, python_build_task, dotnet_build_task
+from hephaestus.generate import generate_pipeline
+from hephaestus.watch import PipelineWatcher
+import yaml, sys
+
+templates = sys.argv[1]
+edits = [
+    [python_build_task(0), dotnet_build_task(1)],
+    [python_build_task(0), docker_build_task(1)],
+    [docker_build_task(1)],
+    [dotnet_build_task(1), python_build_task(0), docker_build_task(2)],
+]
+
+watcher = PipelineWatcher('pipeline.yml', templates)
+status = 0
+for i, tasks in enumerate(edits):
+    with open('pipeline.yml', 'w') as f:
+        yaml.dump({ 'tasks': tasks }, f)
+    _, watched = watcher.update({ watcher.file })
+    with open('pipeline.yml', 'r') as f:
+        expected = generate_pipeline(yaml.safe_load(f), templates)
+    if watched != expected:
+        print(f'edit {i}: watch output differs from generate')
+        status = 1
+    else:
+        print(f'edit {i}: ok')
+sys.exit(status)
+EOF
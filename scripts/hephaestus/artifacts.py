@@ -0,0 +1,129 @@
+from .needs import get_jobs, get_stages
+import re
+
+artifacts_modes = ['report', 'minimal']
+
+# artifacts of jobs in the root and parent pipelines, which child pipelines need across pipelines
+external_artifacts = {
+    'generate': ['generated_pipeline.yml', 'pipelines'],
+    'docker-check-changes': ['changed_services.yml', 'generated_pipeline.yml'],
+}
+
+# artifacts that scripts read without naming them, e.g. `make ... untar PROJECT=a APP=b` reads a-b.enc
+implied_artifacts = [
+    (re.compile(r'makefile untar PROJECT=(\S+) APP=(\S+)'), lambda m: f'{m.group(1)}-{m.group(2)}.enc'),
+    (re.compile(r'makefile untar PROJECT=(\S+)(?!\S| APP=)'), lambda m: f'{m.group(1)}.enc'),
+]
+
+def normalize_path(path: str):
+    # globs and variables can't be matched against a script, so only the literal prefix is kept
+    path = re.split(r'[*?\[$]', str(path))[0]
+    while path.startswith('./'):
+        path = path[2:]
+    return path.rstrip('/')
+
+def get_artifact_paths(job):
+    artifacts = job.get('artifacts')
+    if not isinstance(artifacts, dict):
+        return None
+    if 'dotenv' in (artifacts.get('reports') or {}):
+        # dotenv reports pass variables rather than files, any job could be using them
+        return ['']
+    return artifacts.get('paths') or None
+
+def flatten(value):
+    if isinstance(value, dict):
+        return [s for v in value.values() for s in flatten(v)]
+    if isinstance(value, list):
+        return [s for v in value for s in flatten(v)]
+    return [str(value)]
+
+def get_consumed_text(job):
+    parts = flatten([job.get(k, []) for k in ['before_script', 'script', 'after_script', 'variables']])
+    text = '\n'.join(parts)
+    for pattern, get_path in implied_artifacts:
+        parts += [get_path(m) for m in pattern.finditer(text)]
+    return '\n'.join(parts)
+
+def consumes(text: str, paths: list[str], uploads: list[str]):
+    for path in paths:
+        path = normalize_path(path)
+        if len(path) == 0 or re.search(rf'(?<![\w.-]){re.escape(path)}(?![\w.-])', text):
+            return True
+        # jobs that upload the path again, like `pages`, consume it as well
+        if any(path == u or path.startswith(u + '/') for u in uploads):
+            return True
+    return False
+
+def minimize_needs(job, text, uploads, producers):
+    needs = []
+    skipped = 0
+    for need in job['needs']:
+        if isinstance(need, str):
+            need = { 'job': need }
+        elif not isinstance(need, dict) or 'project' in need or need.get('artifacts') is False:
+            needs.append(need)
+            continue
+
+        if 'pipeline' in need:
+            paths = external_artifacts.get(need.get('job'))
+            # the other pipeline has already run, so a need that downloads nothing can be dropped
+            if paths is not None and not consumes(text, paths, uploads):
+                skipped += 1
+                continue
+            needs.append(need)
+            continue
+
+        paths = producers.get(need['job'])
+        if paths is None:
+            needs.append(need)
+            continue
+        consumed = consumes(text, paths, uploads)
+        skipped += 0 if consumed else 1
+        needs.append({ **need, 'artifacts': consumed })
+    return needs, skipped
+
+def minimize_artifacts(pipeline):
+    '''
+    Limits the artifacts each job downloads to the ones its scripts use. Jobs with `needs` get
+    `artifacts: false` on the local jobs whose artifacts they don't use, and lose cross pipeline
+    needs they don't use. Jobs that run by stage get `dependencies`. Jobs without a script, like
+    triggers, and jobs that already set `dependencies` are left as they are.
+    '''
+    jobs = get_jobs(pipeline)
+    producers = { name: paths for name, job in jobs.items() if (paths := get_artifact_paths(job)) is not None }
+    stage_indices = { s: i for i, s in enumerate(get_stages(pipeline)) }
+    job_stages = { name: stage_indices.get(job.get('stage', 'test'), 0) for name, job in jobs.items() }
+
+    output = dict(pipeline)
+    skipped = 0
+    for name, job in jobs.items():
+        if 'script' not in job or 'dependencies' in job:
+            continue
+        text = get_consumed_text(job)
+        uploads = [normalize_path(p) for p in get_artifact_paths(job) or []]
+        if 'needs' in job:
+            needs, job_skipped = minimize_needs(job, text, uploads, producers)
+            if job_skipped > 0:
+                output[name] = { **job, 'needs': needs }
+                skipped += job_skipped
+            continue
+
+        earlier = [n for n in producers if job_stages[n] < job_stages[name]]
+        dependencies = [n for n in earlier if consumes(text, producers[n], uploads)]
+        if len(dependencies) < len(earlier):
+            output[name] = { **job, 'dependencies': dependencies }
+            skipped += len(earlier) - len(dependencies)
+    return output, skipped
+
+def apply_artifacts_mode(pipeline, mode: str | None, header: dict):
+    if mode is None:
+        return pipeline
+    if mode not in artifacts_modes:
+        raise ValueError(f'unknown artifacts mode: {mode}')
+
+    output, skipped = minimize_artifacts(pipeline)
+    header['skipped artifact downloads'] = skipped
+    if mode == 'minimal':
+        return output
+    return pipeline
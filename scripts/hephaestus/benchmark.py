@@ -0,0 +1,207 @@
+from .render_template import render_template, load_rendered, get_jinja, task_types
+from .generate import count_job_keys, check_job_collisions, merge_loaded_templates
+import yaml, argparse, json, os, sys, time, tracemalloc, platform
+import statistics
+
+phases = ['render', 'parse', 'collisions', 'merge', 'dump']
+
+def get_benchmark_env():
+    return {
+        'GITLAB_CR_REGISTRY': 'registry.gitlab.com/haondt/cicd/registry',
+        'DOCKER_HUB_REPOSITORY': 'haumea',
+        'CI_COMMIT_TAG': 'v1.2.3',
+        'CI_COMMIT_BRANCH': 'main',
+        'CI_COMMIT_SHORT_SHA': '6a47b57f',
+        'ROOT_PIPELINE_SOURCE': 'push',
+        'CI_PIPELINE_SOURCE': 'push',
+        'CI_RUNNER_HOSTING_TYPE': 'gitlab',
+        'DEFAULT_ARTIFACT_EXPIRY': '1 day',
+    }
+
+def docker_build_task(i, registries=2, custom_tags=2):
+    return {
+        'type': 'docker-build',
+        'image': f'image-{i}',
+        'context': f'images/image-{i}',
+        'file': f'images/image-{i}/Dockerfile',
+        'platforms': ['linux/amd64', 'linux/arm64'],
+        'custom_tags': [f'1.{i}.{t}' for t in range(custom_tags)],
+        'auto': [
+            { 'source': 'push', 'branch': 'main', 'tag_source': 'branch' },
+            { 'source': 'push', 'has_tag': True, 'tag_source': 'tag' },
+        ],
+        'registries': (['gitlab', 'docker-hub'] + [f'registry-{r}' for r in range(registries)])[:registries],
+        'labels': { 'title': f'image-{i}', 'vendor': 'haondt' },
+    }
+
+def python_build_task(i):
+    return {
+        'type': 'python-build',
+        'package': f'package-{i}',
+        'name': f'package-{i}',
+        'inject_pyproject_version': 'pyproject.toml',
+        'auto': [{ 'source': 'push' }],
+        'registries': ['gitlab', 'pypi', 'testpypi'],
+    }
+
+def docs_task(sources):
+    return {
+        'type': 'docs',
+        'sources': [{
+            'subpath': f'project-{s}',
+            'type': 'python' if s % 2 == 0 else 'pelican',
+            'repository': f'https://gitlab.com/haondt/project-{s}.git',
+            'ref': 'main',
+            'install': ['.', 'mkdocs-click'],
+        } for s in range(sources)],
+        'auto': [{ 'source': 'push', 'branch': 'main' }],
+    }
+
+def dotnet_build_task(i, packages=3):
+    return {
+        'type': 'dotnet-build',
+        'name': f'solution-{i}',
+        'auto': [{ 'source': 'push' }],
+        'packages': [{ 'csproj': f'./Project.{i}.{p}/Project.{i}.{p}.csproj' } for p in range(packages)],
+        'registries': ['gitlab'],
+    }
+
+def mixed_tasks(count):
+    # docs renders a shared `pages` job, so there can only be one docs task per pipeline
+    tasks = [docs_task(max(1, min(count // 10, 50)))]
+    builders = [docker_build_task, python_build_task, dotnet_build_task]
+    for i in range(count - 1):
+        tasks.append(builders[i % len(builders)](i))
+    return tasks
+
+def get_cases():
+    cases = {}
+    for count in [10, 100, 1000, 5000]:
+        cases[f'mixed-{count}'] = mixed_tasks(count)
+    # docker-build expands registries x tags into one push job each
+    for registries, custom_tags in [(1, 1), (2, 10), (4, 50), (8, 100)]:
+        cases[f'docker-build-{registries}x{custom_tags}'] = [docker_build_task(i, registries, custom_tags) for i in range(10)]
+    return cases
+
+def run_phases(tasks, env, templates: str | None = None):
+    timings = {}
+    def timed(phase, f):
+        start = time.perf_counter()
+        result = f()
+        timings[phase] = time.perf_counter() - start
+        return result
+
+    task_envs = []
+    for task_index in range(len(tasks)):
+        task_env = { k:v for k,v in env.items() }
+        task_env['INTERNAL_TASK_INDEX'] = str(task_index)
+        task_env['INTERNAL_TASKS_COUNT'] = str(len(tasks))
+        task_envs.append(task_env)
+
+    rendered = timed('render', lambda: [render_template(e, {}, t, templates=templates) for e, t in zip(task_envs, tasks)])
+    loaded = timed('parse', lambda: [load_rendered(r) for r in rendered])
+    timed('collisions', lambda: check_job_collisions(count_job_keys(loaded)))
+    merged = timed('merge', lambda: merge_loaded_templates(loaded))
+    output = timed('dump', lambda: yaml.dump(merged))
+    return timings, merged, output
+
+def run_case(name, tasks, env, templates: str | None = None, repeat: int = 3, memory: bool = True):
+    for i, task in enumerate(tasks):
+        task['index'] = i
+
+    samples = []
+    for _ in range(repeat):
+        timings, merged, output = run_phases(tasks, env, templates)
+        samples.append(timings)
+
+    result = {
+        'name': name,
+        'tasks': len(tasks),
+        'jobs': len([k for k in merged.keys() if k != 'stages']),
+        'output_bytes': len(output.encode('utf-8')),
+        'phases': { p: statistics.median(s[p] for s in samples) for p in phases },
+    }
+    result['total'] = sum(result['phases'].values())
+
+    # tracemalloc slows everything down, so memory is measured on its own run
+    if memory:
+        tracemalloc.start()
+        run_phases(tasks, env, templates)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['peak_memory_bytes'] = peak
+    return result
+
+def run(templates: str | None = None, names: list[str] | None = None, repeat: int = 3, memory: bool = True):
+    import jinja2
+    env = get_benchmark_env()
+    cases = get_cases()
+    # compile everything up front so the first case doesn't pay for it
+    for task_type in task_types.values():
+        get_jinja(templates).get_template(task_type.template)
+    results = []
+    for name, tasks in cases.items():
+        if names and name not in names:
+            continue
+        print(f'running {name}', file=sys.stderr)
+        results.append(run_case(name, tasks, env, templates, repeat, memory))
+    return {
+        'python': platform.python_version(),
+        'jinja2': jinja2.__version__,
+        'pyyaml': yaml.__version__,
+        'repeat': repeat,
+        'cases': results,
+    }
+
+def compare(baseline, current):
+    baseline_cases = { c['name']: c for c in baseline['cases'] }
+    lines = [f'{"":<14} {"baseline":>12} {"current":>12} {"ratio":>8}']
+    for case in current['cases']:
+        if case['name'] not in baseline_cases:
+            continue
+        base = baseline_cases[case['name']]
+        lines.append(case['name'])
+        for key in phases + ['total']:
+            old = base['phases'][key] if key in phases else base['total']
+            new = case['phases'][key] if key in phases else case['total']
+            ratio = new / old if old > 0 else float('inf')
+            lines.append(f'  {key:<12} {old * 1000:>10.2f}ms {new * 1000:>10.2f}ms {ratio:>7.2f}x')
+        if 'peak_memory_bytes' in base and 'peak_memory_bytes' in case:
+            old, new = base['peak_memory_bytes'], case['peak_memory_bytes']
+            lines.append(f'  {"memory":<12} {old / 2**20:>9.2f}MB {new / 2**20:>9.2f}MB {new / old if old > 0 else float("inf"):>7.2f}x')
+    return '\n'.join(lines)
+
+def main():
+    default_templates = os.path.join(os.path.dirname(__file__), '..', '..', 'templates')
+    parser = argparse.ArgumentParser(prog='benchmark')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmarks and write the results as json')
+    run_parser.add_argument('--templates', default=default_templates, help='templates directory')
+    run_parser.add_argument('-o', '--output', help='results file, defaults to stdout')
+    run_parser.add_argument('-c', '--case', action='append', help='only run the named case', choices=list(get_cases().keys()))
+    run_parser.add_argument('-r', '--repeat', type=int, default=3, help='number of timed runs per case, the median is reported')
+    run_parser.add_argument('--no-memory', action='store_true', help='skip measuring peak memory')
+
+    compare_parser = subparsers.add_parser('compare', help='compare two results files')
+    compare_parser.add_argument('baseline', help='results file to compare against')
+    compare_parser.add_argument('current', help='results file to compare')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = json.dumps(run(args.templates, args.case, args.repeat, not args.no_memory), indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(results)
+        else:
+            print(results)
+    elif args.command == 'compare':
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        with open(args.current, 'r') as f:
+            current = json.load(f)
+        print(compare(baseline, current))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+from .needs import get_jobs
+from .render_template import get_helpers
+import fnmatch, os, subprocess
+
+change_modes = ['skip', 'manual']
+
+def git(repo_dir, *args):
+    return subprocess.run(['git', '-C', repo_dir, *args], check=True, capture_output=True, text=True).stdout
+
+zero_sha = '0' * 40
+
+def get_changed_paths(repo_dir: str = '.', env: dict[str, str] | None = None):
+    '''
+    Paths changed by the pipeline: since the merge base for merge request pipelines, or since the
+    previous tip of the branch for pushes, so every commit of a push counts. Returns None when
+    gitlab doesn't know the previous commit, e.g. for the first push of a branch. Outside of a
+    pipeline the current commit is compared to its first parent, like the docker deployer does.
+    '''
+    env = env or {}
+    base = env.get('CI_MERGE_REQUEST_DIFF_BASE_SHA') or env.get('CI_COMMIT_BEFORE_SHA')
+    if base == zero_sha:
+        return None, None
+    try:
+        if base is None:
+            parents = git(repo_dir, 'rev-list', '--parents', '-n', '1', 'HEAD').split()[1:]
+            if len(parents) == 0:
+                return git(repo_dir, 'ls-files').splitlines(), None
+            base = parents[0]
+        return git(repo_dir, 'diff', '--name-only', '--no-renames', base, 'HEAD').splitlines(), base
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        # not a repository, or a shallow clone without the base, so we can't tell what changed
+        return None, None
+
+def get_parent_dir(path: str):
+    return os.path.dirname(os.path.normpath(path)) or '.'
+
+default_change_filters = {
+    'docker-build': lambda task: [task.get('context', '.'), task.get('file', 'Dockerfile')],
+    'python-build': lambda task: [p.get('context', '.') for p in get_helpers('python_build').get_packages(task)],
+    'dotnet-build': lambda task: [get_parent_dir(p['csproj']) for p in task.get('packages', [])],
+    'docs': lambda task: None if any('repository' in s for s in task.get('sources', [])) else [s.get('context', '.') for s in task.get('sources', [])],
+}
+
+def get_change_filters(task):
+    filters = task.get('changes')
+    if filters is None or filters is False:
+        return None
+    if filters is True:
+        get_defaults = default_change_filters.get(task.get('type'))
+        return get_defaults(task) if get_defaults is not None else None
+    return filters
+
+def matches_filter(path: str, pattern: str):
+    pattern = os.path.normpath(pattern)
+    if pattern == '.':
+        return True
+    if any(c in pattern for c in '*?['):
+        return fnmatch.fnmatch(path, pattern)
+    return path == pattern or path.startswith(pattern + '/')
+
+def get_task_activation(task, changed_paths: list[str] | None, env):
+    '''
+    Returns None for tasks that render as usual, or the `changes_mode` of tasks with `changes`
+    filters that none of the changed paths match. Tag pipelines render every task, since a
+    release is expected to publish everything.
+    '''
+    filters = get_change_filters(task)
+    if filters is None or changed_paths is None or env.get('CI_COMMIT_TAG') is not None:
+        return None
+    if any(matches_filter(path, f) for path in changed_paths for f in filters):
+        return None
+    mode = task.get('changes_mode', 'skip')
+    if mode not in change_modes:
+        raise ValueError(f'unknown changes mode: {mode}')
+    return mode
+
+def get_task_activations(tasks, env, repo_dir: str = '.'):
+    activations = [None] * len(tasks)
+    if not any(get_change_filters(task) is not None for task in tasks):
+        return activations
+    changed_paths, _ = get_changed_paths(repo_dir, env)
+    return [get_task_activation(task, changed_paths, env) for task in tasks]
+
+def make_manual(loaded):
+    output = dict(loaded)
+    for name, job in get_jobs(loaded).items():
+        if 'rules' not in job:
+            output[name] = { **job, 'when': 'manual' }
+    return output
@@ -0,0 +1,59 @@
+import os
+
+_env: dict[str, str] | None = None
+def get_env():
+    global _env
+    if _env is None:
+        env = {}
+        def cpy(key):
+            nonlocal env
+            env[key] = os.environ[key]
+        def trycpy(key):
+            nonlocal env
+            if key in os.environ:
+                env[key] = os.environ[key]
+
+        cpy('GITLAB_CR_REGISTRY')
+        trycpy('DOCKER_HUB_REPOSITORY')
+
+        trycpy('CI_COMMIT_TAG')
+        trycpy('CI_COMMIT_BRANCH')
+        trycpy('CI_DEFAULT_BRANCH')
+        trycpy('CI_COMMIT_BEFORE_SHA')
+        trycpy('CI_MERGE_REQUEST_DIFF_BASE_SHA')
+        cpy('CI_COMMIT_SHORT_SHA')
+        cpy('ROOT_PIPELINE_SOURCE')
+        cpy('CI_PIPELINE_SOURCE')
+        trycpy('CI_RUNNER_HOSTING_TYPE')
+
+        env['DEFAULT_ARTIFACT_EXPIRY'] = '1 day'
+        trycpy('DEFAULT_ARTIFACT_EXPIRY')
+
+        _env = env
+
+    return _env
+
+def get_public_env(private_env: dict[str, str] | None = None):
+    private_env = private_env if private_env is not None else get_env()
+    env = {}
+    for key in [
+        'GITLAB_CR_REGISTRY',
+        'DOCKER_HUB_REPOSITORY',
+        'CI_COMMIT_TAG',
+        'CI_COMMIT_BRANCH',
+        'CI_COMMIT_SHORT_SHA',
+        'ROOT_PIPELINE_SOURCE'
+        'CI_PIPELINE_SOURCE',
+        'DEFAULT_ARTIFACT_EXPIRY'
+        ]:
+        if key in private_env:
+            env[key] = private_env[key]
+    return env
+
+def parse_bool_env_var(var_name, default=False):
+    value = os.getenv(var_name)
+    if value is not None:
+        value_str = str(value).lower()
+        return value_str in ('true', '1') or \
+               (value_str.isdigit() and int(value_str) != 0)
+    return default
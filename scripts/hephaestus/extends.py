@@ -0,0 +1,108 @@
+from .needs import get_jobs
+import hashlib, json
+
+dedupe_modes = ['extends', 'verify']
+
+hidden_prefix = '.hephaestus-'
+
+def get_fragment_name(fragment):
+    digest = hashlib.sha256(json.dumps(fragment, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return f'{hidden_prefix}{digest[:12]}'
+
+def is_worth_hoisting(fragment, count, name):
+    # each job trades its copy of the keys for an entry in its extends list
+    size = len(json.dumps(fragment, default=str))
+    return count > 1 and count * size > size + len(name) + count * (len(name) + 4)
+
+def find_shared_fragments(jobs):
+    '''
+    Finds the key/value pairs shared by more than one job, then groups the pairs that are shared by
+    exactly the same jobs, so e.g. the dind `services` and `variables` end up in one fragment.
+    '''
+    occurrences = {}
+    for job_name, job in jobs.items():
+        if 'extends' in job:
+            continue
+        for key, value in job.items():
+            pair = json.dumps([key, value], sort_keys=True, default=str)
+            if pair not in occurrences:
+                occurrences[pair] = (key, value, [])
+            occurrences[pair][2].append(job_name)
+
+    grouped = {}
+    for key, value, job_names in occurrences.values():
+        if len(job_names) > 1:
+            grouped.setdefault(tuple(job_names), {})[key] = value
+
+    fragments = {}
+    for job_names, fragment in grouped.items():
+        name = get_fragment_name(fragment)
+        if is_worth_hoisting(fragment, len(job_names), name):
+            fragments[name] = { 'keys': fragment, 'jobs': list(job_names) }
+    return fragments
+
+def hoist_shared_fragments(pipeline):
+    '''
+    Moves top level job keys whose values are repeated across jobs into hidden jobs that the
+    jobs `extends`. A job never sets a key it gets from one of its hidden jobs, and no two of
+    its hidden jobs share a key, so gitlab's merge of the extends list gives back the original job.
+    '''
+    jobs = get_jobs(pipeline)
+    fragments = find_shared_fragments(jobs)
+    if len(fragments) == 0:
+        return pipeline
+
+    output = dict(pipeline)
+    extends = {}
+    for name, fragment in sorted(fragments.items()):
+        output[name] = fragment['keys']
+        for job_name in fragment['jobs']:
+            extends.setdefault(job_name, []).append(name)
+    for job_name, names in extends.items():
+        hoisted = set(k for n in names for k in fragments[n]['keys'])
+        output[job_name] = { 'extends': names, **{ k: v for k, v in jobs[job_name].items() if k not in hoisted } }
+    return output
+
+def merge_extended(base, override):
+    # gitlab only merges hashes, any other value is replaced
+    result = dict(base)
+    for k, v in override.items():
+        if isinstance(v, dict) and isinstance(result.get(k), dict):
+            result[k] = merge_extended(result[k], v)
+        else:
+            result[k] = v
+    return result
+
+def expand_job(pipeline, name, visiting=()):
+    job = pipeline[name]
+    if 'extends' not in job:
+        return job
+    if name in visiting:
+        raise ValueError(f'cycle in extends at {name}')
+    parents = job['extends'] if isinstance(job['extends'], list) else [job['extends']]
+    expanded = {}
+    for parent in parents:
+        expanded = merge_extended(expanded, expand_job(pipeline, parent, (*visiting, name)))
+    return merge_extended(expanded, { k: v for k, v in job.items() if k != 'extends' })
+
+def expand_extends(pipeline):
+    output = { k: v for k, v in pipeline.items() if not k.startswith(hidden_prefix) }
+    for name in get_jobs(pipeline):
+        output[name] = expand_job(pipeline, name)
+    return output
+
+def apply_dedupe_mode(pipeline, mode: str | None, header: dict):
+    if mode is None:
+        return pipeline
+    if mode not in dedupe_modes:
+        raise ValueError(f'unknown dedupe mode: {mode}')
+
+    output = hoist_shared_fragments(pipeline)
+    header['hoisted fragments'] = sum(1 for k in output if k.startswith(hidden_prefix))
+    if mode == 'verify':
+        expected, expanded = expand_extends(pipeline), expand_extends(output)
+        mismatched = sorted(k for k in set(expected) | set(expanded) if expected.get(k) != expanded.get(k))
+        if len(mismatched) > 0:
+            raise ValueError(f'deduplicated pipeline does not expand back to the original, mismatched keys: {", ".join(mismatched)}')
+        header['dedupe verified'] = True
+    return output
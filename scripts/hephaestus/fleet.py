@@ -0,0 +1,130 @@
+from .render_template import load_pipeline_config, load_yaml, get_jinja
+from .generate import generate_pipeline, finish_pipeline
+from .render_arguments import add_needs_argument, add_dedupe_argument, add_artifacts_argument, OutputOptions, get_output_options
+import argparse, difflib, os, sys
+
+base_profile = {
+    'GITLAB_CR_REGISTRY': 'registry.gitlab.com/haondt/cicd/registry',
+    'DOCKER_HUB_REPOSITORY': 'haumea',
+    'CI_COMMIT_SHORT_SHA': '6a47b57f',
+    'CI_DEFAULT_BRANCH': 'main',
+    'DEFAULT_ARTIFACT_EXPIRY': '1 day',
+}
+
+default_profiles = {
+    'push': { 'CI_COMMIT_BRANCH': 'main', 'CI_PIPELINE_SOURCE': 'push', 'ROOT_PIPELINE_SOURCE': 'push' },
+    'web': { 'CI_COMMIT_BRANCH': 'main', 'CI_PIPELINE_SOURCE': 'web', 'ROOT_PIPELINE_SOURCE': 'web' },
+    'tag': { 'CI_COMMIT_TAG': 'v1.0.0', 'CI_PIPELINE_SOURCE': 'push', 'ROOT_PIPELINE_SOURCE': 'push' },
+    'push-gitlab-runner': { 'CI_COMMIT_BRANCH': 'main', 'CI_PIPELINE_SOURCE': 'push', 'ROOT_PIPELINE_SOURCE': 'push', 'CI_RUNNER_HOSTING_TYPE': 'gitlab' },
+}
+
+def load_profiles(file: str | None = None):
+    profiles = load_yaml(file) if file is not None else default_profiles
+    return { name: { **base_profile, **{ k: str(v) for k, v in (env or {}).items() } } for name, env in profiles.items() }
+
+def get_repo_name(pipeline_file: str, root: str):
+    repo_dir = os.path.dirname(os.path.realpath(pipeline_file))
+    name = os.path.relpath(repo_dir, root)
+    if name == '.':
+        return os.path.basename(root)
+    # keep outputs of repositories outside the root inside the output directory
+    return name if not name.startswith('..') else repo_dir.lstrip('/')
+
+def render_repo(pipeline_file: str, profiles: dict[str, dict[str, str]], templates: str | None, options: OutputOptions):
+    '''
+    Renders one pipeline file with every env profile. Failures are kept as the output of the
+    profile, so a template change that starts or stops raising shows up in the diff too.
+    '''
+    outputs = {}
+    try:
+        data = load_pipeline_config(pipeline_file)
+    except Exception as e:
+        return { name: f'error: {type(e).__name__}: {e}' for name in profiles }
+    for name, env in profiles.items():
+        try:
+            # change filters are skipped, the repositories aren't checked out
+            pipeline = generate_pipeline(data, templates, env=env, repo_dir=None)
+            outputs[name] = finish_pipeline(pipeline, options, env=env)
+        except Exception as e:
+            outputs[name] = f'error: {type(e).__name__}: {e}'
+    return outputs
+
+def _render_repo_args(args):
+    return render_repo(*args)
+
+def render_fleet(pipeline_files: list[str], profiles, templates: str | None, options: OutputOptions, jobs: int = 1):
+    repo_args = [(f, profiles, templates, options) for f in pipeline_files]
+    if jobs <= 1 or len(repo_args) <= 1:
+        get_jinja(templates)
+        return [render_repo(*a) for a in repo_args]
+    from concurrent.futures import ProcessPoolExecutor
+    # each worker keeps its own jinja environment and imported helpers for all the repos it renders
+    with ProcessPoolExecutor(max_workers=min(jobs, len(repo_args)), initializer=get_jinja, initargs=(templates,)) as executor:
+        return list(executor.map(_render_repo_args, repo_args, chunksize=max(1, len(repo_args) // (jobs * 4))))
+
+def read_output(path: str):
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as f:
+        return f.read()
+
+def write_output(path: str, output: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(output)
+
+def get_pipeline_files(paths: list[str], list_file: str | None):
+    files = list(paths)
+    if list_file is not None:
+        with open(list_file, 'r') as f:
+            files += [l.strip() for l in f if l.strip() and not l.strip().startswith('#')]
+    # directories stand for the pipeline.yml inside them
+    return [os.path.join(f, 'pipeline.yml') if os.path.isdir(f) else f for f in files]
+
+def main():
+    parser = argparse.ArgumentParser(prog='fleet', description='render many pipeline files with several env profiles, optionally diffing against a baseline')
+    parser.add_argument('pipelines', nargs='*', help='pipeline files, or repository directories containing a pipeline.yml')
+    parser.add_argument('--list', help='file with one pipeline file or repository directory per line')
+    parser.add_argument('--root', default='.', help='directory the repository names are relative to')
+    parser.add_argument('--profiles', help='yaml file mapping profile names to env variables, defaults to push, web, tag and push-gitlab-runner')
+    parser.add_argument('--templates', help='templates directory')
+    parser.add_argument('-o', '--output', required=True, help='directory to write <repo>/<profile>.yml outputs to')
+    parser.add_argument('--baseline', help='directory with outputs of an earlier run to diff against')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    parser.add_argument('--format', default='yaml', choices=['yaml', 'json'], help='output format, json is also valid gitlab ci yaml')
+    add_needs_argument(parser)
+    add_dedupe_argument(parser)
+    add_artifacts_argument(parser)
+    args = parser.parse_args()
+
+    pipeline_files = get_pipeline_files(args.pipelines, args.list)
+    profiles = load_profiles(args.profiles)
+    root = os.path.realpath(args.root)
+    extension = 'json' if args.format == 'json' else 'yml'
+
+    counts = { 'unchanged': 0, 'changed': 0, 'new': 0, 'failed': 0 }
+    for pipeline_file, outputs in zip(pipeline_files, render_fleet(pipeline_files, profiles, args.templates, get_output_options(args), args.jobs)):
+        repo = get_repo_name(pipeline_file, root)
+        for profile, output in outputs.items():
+            if output.startswith('error: '):
+                counts['failed'] += 1
+            path = os.path.join(repo, f'{profile}.{extension}')
+            write_output(os.path.join(args.output, path), output + '\n')
+            if args.baseline is None:
+                continue
+            previous = read_output(os.path.join(args.baseline, path))
+            if previous is None:
+                counts['new'] += 1
+            elif previous == output + '\n':
+                counts['unchanged'] += 1
+            else:
+                counts['changed'] += 1
+                sys.stdout.writelines(difflib.unified_diff(previous.splitlines(keepends=True), (output + '\n').splitlines(keepends=True),
+                    f'baseline/{path}', f'output/{path}'))
+
+    print(f'rendered {len(pipeline_files)} repositories with {len(profiles)} profiles: ' + ', '.join(f'{v} {k}' for k, v in counts.items()), file=sys.stderr)
+    if counts['changed'] > 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
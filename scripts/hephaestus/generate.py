@@ -1,48 +1,193 @@
-from .render_template import load_pipeline_config, get_env, get_public_env, render_template
-from .utils import deep_merge
-import yaml, argparse
+from .render_template import load_pipeline_config, load_rendered, get_env, get_public_env, render_template, dump_pipeline, get_jinja, get_helpers, task_types
+from .render_cache import RenderCache, get_render_cache
+from .utils import deep_merge_into
+from .needs import apply_needs_mode
+from .extends import apply_dedupe_mode
+from .artifacts import apply_artifacts_mode
+from .changes import get_task_activations, make_manual
+from .render_arguments import add_needs_argument, add_dedupe_argument, add_artifacts_argument, add_profile_arguments, OutputOptions, get_output_options
+from .profiling import Profiler, get_profiler, finish_profiler, profile_phase
+import yaml, argparse, sys, time
 
-def generate_steps(data, templates: str | None=None):
+def get_template_cache_stats(templates: str | None=None):
+    template_cache = get_jinja(templates).bytecode_cache
+    if template_cache is None:
+        return 0, 0
+    return template_cache.hits, template_cache.misses
 
-    tasks = data.get('tasks', [])
-    rendered_templates = []
-    env = get_env()
+def render_task(task_env, task, templates: str | None=None, cache: RenderCache | None=None):
+    template_hits, template_misses = get_template_cache_stats(templates)
+    start = time.perf_counter()
+    rendered = render_template(task_env, {}, task, templates=templates, cache=cache)
+    rendered_at = time.perf_counter()
+    loaded = load_rendered(rendered)
+    parsed_at = time.perf_counter()
+    template_hits_after, template_misses_after = get_template_cache_stats(templates)
+
+    profile = {
+        'index': task.get('index'),
+        'type': task.get('type'),
+        'render': rendered_at - start,
+        'parse': parsed_at - rendered_at,
+        'output_bytes': len(rendered.encode('utf-8')),
+        'template_cache_hits': template_hits_after - template_hits,
+        'template_cache_misses': template_misses_after - template_misses,
+    }
+    if cache is not None:
+        profile['render_cache_hit'] = cache.hits > 0
+    return loaded, cache, profile
+
+def get_task_env(env, task_index: int, tasks_count: int):
+    task_env = { k:v for k,v in env.items() }
+    task_env['INTERNAL_TASK_INDEX'] = str(task_index)
+    task_env['INTERNAL_TASKS_COUNT'] = str(tasks_count)
+    return task_env
+
+def resolve_task_inputs(tasks, env, activations: list[str | None], repo_dir: str='.'):
+    for task, activation in zip(tasks, activations):
+        definition = task_types.get(task.get('type'))
+        if activation != 'skip' and definition is not None and definition.resolve_inputs is not None:
+            getattr(get_helpers(definition.helpers), definition.resolve_inputs)(task, env, repo_dir)
+
+def _render_task_args(args):
+    return render_task(*args)
+
+def render_tasks(tasks, env, templates: str | None=None, jobs: int=1, cache: RenderCache | None=None, profiler: Profiler | None=None, activations: list[str | None] | None=None):
+    activations = activations or [None] * len(tasks)
+    task_args = []
+    task_activations = []
     for task_index, task in enumerate(tasks):
-        task_env = { k:v for k,v in env.items() }
-        task_env['INTERNAL_TASK_INDEX'] = str(task_index)
-        task_env['INTERNAL_TASKS_COUNT'] = str(len(tasks))
-        rendered_templates.append(render_template(task_env, {}, task, templates=templates))
-
-    allowed_top_level_merge_keys = [
-        'stages'
-    ]
-
-    loaded_templates = [yaml.safe_load(t) for t in rendered_templates]
-    jobs = [k for t in loaded_templates for k in t.keys()]
-    counts = {k: jobs.count(k) for k in set(jobs) if k not in allowed_top_level_merge_keys and jobs.count(k) > 1}
+        if activations[task_index] == 'skip':
+            print(f'skipping task {task_index} ({task.get("type")}), none of its `changes` paths changed', file=sys.stderr)
+            continue
+        task_activations.append(activations[task_index])
+        # each task gets its own cache handle so hit counts survive the trip back from a worker
+        task_args.append((get_task_env(env, task_index, len(tasks)), task, templates, cache.fork() if cache is not None else None))
+
+    if jobs <= 1 or len(task_args) <= 1:
+        results = [render_task(*a) for a in task_args]
+    else:
+        # imported here since most pipelines are small enough to render without a pool
+        from concurrent.futures import ProcessPoolExecutor
+        # executor.map yields results in submission order, so the merge stays deterministic
+        with ProcessPoolExecutor(max_workers=min(jobs, len(task_args))) as executor:
+            chunksize = max(1, len(task_args) // (jobs * 4))
+            results = list(executor.map(_render_task_args, task_args, chunksize=chunksize))
+
+    if cache is not None:
+        for _, task_cache, _ in results:
+            cache.join(task_cache)
+    if profiler is not None:
+        profiler.add_tasks([profile for _, _, profile in results])
+    return [make_manual(loaded) if activation == 'manual' else loaded for (loaded, _, _), activation in zip(results, task_activations)]
+
+allowed_top_level_merge_keys = [
+    'stages'
+]
+
+def count_job_keys(loaded_templates):
+    key_counts = {}
+    for loaded in loaded_templates:
+        for k in loaded.keys():
+            key_counts[k] = key_counts.get(k, 0) + 1
+    return key_counts
+
+def check_job_collisions(key_counts):
+    counts = {k: v for k, v in key_counts.items() if k not in allowed_top_level_merge_keys and v > 1}
     if len(counts) > 0:
         rendered_counts = '\n'.join([f'{k}: {v}' for k, v in counts.items()])
         raise Exception(f'Rendering resulted in one or more jobs with overlapping keys: \n{rendered_counts}')
 
+def merge_loaded_templates(loaded_templates):
     merged_output = {}
-    for rendered in rendered_templates:
-        merged_output = deep_merge(merged_output, yaml.safe_load(rendered))
+    for loaded in loaded_templates:
+        deep_merge_into(merged_output, loaded)
+    return merged_output
+
+def merge_templates(loaded_templates, profiler: Profiler | None=None):
+    with profile_phase(profiler, 'collisions'):
+        check_job_collisions(count_job_keys(loaded_templates))
+    with profile_phase(profiler, 'merge'):
+        return merge_loaded_templates(loaded_templates)
+
+def generate_pipeline(data, templates: str | None=None, jobs: int=1, cache: RenderCache | None=None, profiler: Profiler | None=None,
+        env: dict[str, str] | None=None, repo_dir: str | None='.'):
+    '''
+    `env` defaults to the process env. `repo_dir` is the repository the `changes` filters and
+    build inputs of tasks are checked against, if None every task is rendered and built.
+    '''
+
+    tasks = data.get('tasks', [])
+    with profile_phase(profiler, 'env'):
+        env = env if env is not None else get_env()
+    with profile_phase(profiler, 'jinja'):
+        get_jinja(templates)
+    with profile_phase(profiler, 'changes'):
+        activations = get_task_activations(tasks, env, repo_dir) if repo_dir is not None else [None] * len(tasks)
+    with profile_phase(profiler, 'inputs'):
+        if repo_dir is not None:
+            resolve_task_inputs(tasks, env, activations, repo_dir)
+    with profile_phase(profiler, 'render'):
+        loaded_templates = render_tasks(tasks, env, templates, jobs, cache, profiler, activations)
+        if len(loaded_templates) == 0 and 'skip' in activations:
+            loaded_templates = [render_noop(env, templates)]
 
-    return yaml.dump(merged_output)
+    return merge_templates(loaded_templates, profiler)
+
+def render_noop(env, templates: str | None=None):
+    # gitlab won't create a pipeline without jobs
+    return load_rendered(render_template(env, {}, {}, 'noop', templates))
+
+def generate_steps(data, templates: str | None=None, jobs: int=1, cache: RenderCache | None=None):
+    return yaml.dump(generate_pipeline(data, templates, jobs, cache))
+
+def finish_pipeline(pipeline, options: OutputOptions, cache: RenderCache | None=None, profiler: Profiler | None=None, env: dict[str, str] | None=None):
+    header = get_public_env(env)
+    if cache is not None:
+        header['render cache'] = cache.describe()
+    with profile_phase(profiler, 'artifacts'):
+        pipeline = apply_artifacts_mode(pipeline, options.artifacts, header)
+    with profile_phase(profiler, 'needs'):
+        pipeline = apply_needs_mode(pipeline, options.needs, header)
+    with profile_phase(profiler, 'dedupe'):
+        pipeline = apply_dedupe_mode(pipeline, options.dedupe, header)
+    with profile_phase(profiler, 'dump'):
+        return dump_pipeline(pipeline, options.format, header)
 
 def main():
     parser = argparse.ArgumentParser(prog='generate')
     parser.add_argument('--templates', help='templates directory')
     parser.add_argument('-f', '--file', help='pipeline file')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes used to render tasks')
+    parser.add_argument('--cache', help='rendered template cache directory')
+    parser.add_argument('--format', default='yaml', choices=['yaml', 'json'], help='output format, json is also valid gitlab ci yaml')
+    add_needs_argument(parser)
+    add_dedupe_argument(parser)
+    add_artifacts_argument(parser)
+    add_profile_arguments(parser)
+    parser.add_argument('--watch', action='store_true', help='keep running, re-rendering the tasks affected by changes to the pipeline file or templates and printing a diff of the output')
+    parser.add_argument('--watch-interval', type=float, default=1.0, help='seconds between checks for changes in watch mode')
     args = parser.parse_args()
 
-    data = load_pipeline_config(args.file)
-    steps = generate_steps(data, args.templates)
-    public_env = get_public_env()
-    for k, v in public_env.items():
-        print(f'# {k}: {v}')
+    cache = get_render_cache(args.cache)
+    if args.watch:
+        from .watch import watch_pipeline
+        watch_pipeline(args.file, args.templates, cache, lambda pipeline: finish_pipeline(pipeline, get_output_options(args), cache), args.watch_interval)
+        return
+
+    profiler = get_profiler('generate', args.profile, args.profile_report)
+    with profile_phase(profiler, 'load config'):
+        data = load_pipeline_config(args.file)
+    pipeline = generate_pipeline(data, args.templates, args.jobs, cache, profiler)
+    output = finish_pipeline(pipeline, get_output_options(args), cache, profiler)
+    print(output)
 
-    print(steps)
+    if profiler is not None:
+        profiler.add_stat('output_bytes', len(output.encode('utf-8')))
+        if cache is not None:
+            profiler.add_stat('render_cache_hits', cache.hits)
+            profiler.add_stat('render_cache_misses', cache.misses)
+    finish_profiler(profiler, args.profile_report)
 
 if __name__ == '__main__':
     main()
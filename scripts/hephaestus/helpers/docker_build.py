@@ -1,4 +1,6 @@
-from ..utils import try_get_version
+from ..utils import try_get_version, compile_regex
+from ..rules import compile_auto_rules
+import hashlib, json, os, re, sys
 
 def get_tags(task, env):
     tags = {
@@ -17,6 +19,8 @@ def get_tags(task, env):
     if custom_tags is not None:
         for i, tag in enumerate(custom_tags):
             tags[f'custom-{i}'] = tag
+    if 'inputs_digest' in task:
+        tags['inputs'] = get_inputs_tag(task['inputs_digest'])
     return tags
 
 def get_version(env):
@@ -27,37 +31,290 @@ def get_version(env):
         return env['CI_COMMIT_BRANCH'] + '-' + env['CI_COMMIT_SHORT_SHA']
     return None
 
+def get_auto_rules(task, env):
+    return compile_auto_rules(task, env, ['source', 'has_tag', 'branch', 'tag_source'])
+
+def is_manual_tag(auto_rules, tag_source):
+    # the inputs tag is what later pipelines look up to skip the build, so it is always pushed
+    return tag_source != 'inputs' and auto_rules.is_manual(tag_source)
+
 def should_use_manual_push(task, tag_source, env):
-    auto_push_on = task.get('auto')
-    if auto_push_on is None:
-        return True
+    return is_manual_tag(get_auto_rules(task, env), tag_source)
 
-    source = env['ROOT_PIPELINE_SOURCE']
-    has_tag = 'CI_COMMIT_TAG' in env
-    branch = env.get('CI_COMMIT_BRANCH')
+def get_tags_by_manual(task, env):
+    # tags that show up more than once take the rules of the last one, as the expanded jobs would
+    auto_rules = get_auto_rules(task, env)
+    manual_tags = { tag: is_manual_tag(auto_rules, tag_source) for tag_source, tag in get_tags(task, env).items() }
+    by_manual = {}
+    for tag, manual in manual_tags.items():
+        by_manual.setdefault(manual, []).append(tag)
+    return by_manual
+
+def get_push_groups(task, env):
+    '''
+    one push job per registry and tag. with `matrix` set, the tags of a registry are collapsed
+    into a parallel:matrix job instead, split in two when only some of them are manual.
+    '''
+    auto_rules = get_auto_rules(task, env)
+    tags = get_tags(task, env)
+    groups = []
+    for registry in task.get('registries', []):
+        if task.get('matrix') != True:
+            for tag_source, tag in tags.items():
+                groups.append({ 'registry': registry, 'manual': is_manual_tag(auto_rules, tag_source), 'tags': [tag] })
+            continue
+        for manual, group_tags in get_tags_by_manual(task, env).items():
+            groups.append({ 'registry': registry, 'manual': manual, 'tags': group_tags })
 
-    def check_entry(entry):
-        nonlocal source
-        nonlocal has_tag
-        nonlocal branch
-        if 'source' in entry:
-            if entry['source'] != source:
-                return False
-        if 'has_tag' in entry:
-            if bool(entry['has_tag']) != has_tag:
-                return False
-        if 'branch' in entry:
-            if entry['branch'] != branch:
-                return False
-        if 'tag_source' in entry:
-            if entry['tag_source'] != tag_source:
-                return False
-        return True
-
-    for entry in auto_push_on:
-        if check_entry(entry):
-            return False
-    return True
+    for group in groups:
+        if len(group['tags']) == 1:
+            group['name'] = f'docker-push-{task["image"]}:{group["registry"]}:{group["tags"][0]}'
+        else:
+            group['name'] = f'docker-push-{task["image"]}:{group["registry"]}' + (':manual' if group['manual'] else '')
+    return groups
 
 def is_gitlab_hosted_runner(env):
     return env.get('CI_RUNNER_HOSTING_TYPE') == 'gitlab'
+
+def get_repository(registry, image, env):
+    if registry == 'gitlab':
+        return f'{env["GITLAB_CR_REGISTRY"]}/{image}'
+    if registry == 'docker-hub':
+        return f'{env["DOCKER_HUB_REPOSITORY"]}/{image}'
+    raise ValueError(f'unknown registry: {registry}')
+
+def get_publish_groups(task, env, job_prefix='docker-publish'):
+    '''
+    with `publish: oci`, one job pushes every auto tag to every registry, and another one the
+    manual tags. the first tag of each registry is pushed from the oci layout, the others are
+    tagged remotely, which only uploads the manifest.
+    '''
+    groups = []
+    for manual, tags in get_tags_by_manual(task, env).items():
+        groups.append({
+            'name': f'{job_prefix}-{task["image"]}' + (':manual' if manual else ''),
+            'manual': manual,
+            'repositories': [{ 'registry': r, 'repository': get_repository(r, task['image'], env), 'tags': tags } for r in task.get('registries', [])],
+        })
+    return groups
+
+def get_cache_branches(env):
+    # branches whose cache is imported, most specific first, and the branch the cache is exported for.
+    # tag pipelines only read the default branch's cache
+    branch = env.get('CI_COMMIT_BRANCH')
+    default_branch = env.get('CI_DEFAULT_BRANCH')
+    imported = [b.replace('/', '-') for b in dict.fromkeys([branch, default_branch]) if b is not None]
+    return imported, branch.replace('/', '-') if branch is not None else None
+
+def get_build_cache(task, env, platform=None):
+    '''
+    the `--cache-from`/`--cache-to` arguments for the `cache` block of a task, along with the
+    registry to log in to and, for the local backend, the gitlab cache of the job. native builds
+    of a single platform keep their own cache, so they don't overwrite each other's.
+    '''
+    cache = task.get('cache')
+    if cache is None or cache is False:
+        return None
+    cache = {} if cache is True else cache
+    cache_type = cache.get('type', 'registry')
+    mode = cache.get('mode', 'max')
+    imported, exported = get_cache_branches(env)
+    image = task['image']
+    suffix = '' if platform is None else '-' + get_platform_slug(platform)
+
+    if cache_type == 'local':
+        path = cache.get('path', '.buildx-cache')
+        keys = [f'docker-build-{image}-{b}{suffix}' for b in imported]
+        return {
+            'type': cache_type,
+            'cache_from': [f'type=local,src={path}'],
+            # written next to the old cache and swapped in after the build, so the directory doesn't grow forever
+            'cache_to': f'type=local,dest={path}-new,mode={mode}' if exported is not None else None,
+            'path': path,
+            'key': keys[0] if len(keys) > 0 else f'docker-build-{image}{suffix}',
+            'fallback_keys': keys[1:],
+            'policy': 'pull-push' if exported is not None else 'pull',
+            'registry': None,
+        }
+
+    registry = cache.get('registry', (task.get('registries') or ['gitlab'])[0])
+    repository = get_repository(registry, image, env)
+    if cache_type == 'registry':
+        return {
+            'type': cache_type,
+            'cache_from': [f'type=registry,ref={repository}:buildcache-{b}{suffix}' for b in imported],
+            'cache_to': f'type=registry,ref={repository}:buildcache-{exported}{suffix},mode={mode},image-manifest=true,oci-mediatypes=true' if exported is not None else None,
+            'registry': registry,
+        }
+    if cache_type == 'inline':
+        # the cache is embedded in the branch images pushed by the push jobs
+        return {
+            'type': cache_type,
+            'cache_from': [f'type=registry,ref={repository}:{b}' for b in imported],
+            'cache_to': 'type=inline' if exported is not None else None,
+            'registry': registry,
+        }
+    raise ValueError(f'unknown cache type: {cache_type}')
+
+def needs_container_builder(task, cache):
+    # the default docker driver can only export inline caches, and can't write oci layouts
+    return (cache is not None and cache['type'] != 'inline') or task.get('publish') == 'oci'
+
+def get_platform_slug(platform):
+    return platform.replace('/', '-')
+
+def get_platform_builds(task):
+    '''
+    with `runners`, one build job per platform, on the runners with the tags given for it.
+    platforms without runner tags are built on the default runners, emulated with qemu if enabled.
+    '''
+    if not task.get('runners'):
+        return []
+    builds = []
+    for platform in task.get('platforms') or ['linux/amd64']:
+        runner_tags = task['runners'].get(platform, [])
+        slug = get_platform_slug(platform)
+        builds.append({
+            'platform': platform,
+            'name': f'docker-build-{task["image"]}:{slug}',
+            'runner_tags': [runner_tags] if isinstance(runner_tags, str) else runner_tags,
+            'layout': f'{task["image"]}-{slug}.oci',
+        })
+    return builds
+
+inputs_label = 'hephaestus.inputs-digest'
+
+def get_inputs_tag(digest):
+    return f'inputs-{digest}'
+
+def compile_dockerignore_pattern(pattern):
+    # same syntax as the go `filepath.Match` patterns docker uses, plus `**` for any number of directories
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            regex += '(.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+            continue
+        if c == '*':
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        elif c == '[' and ']' in pattern[i + 1:]:
+            end = pattern.index(']', i + 1)
+            regex += pattern[i:end + 1]
+            i = end
+        else:
+            regex += re.escape(c)
+        i += 1
+    return compile_regex(f'^{regex}$')
+
+def load_dockerignore(context, file):
+    # buildkit prefers an ignore file named after the dockerfile over the one in the context
+    for path in [file + '.dockerignore', os.path.join(context, '.dockerignore')]:
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                lines = [l.strip() for l in f]
+            break
+    else:
+        return []
+    patterns = []
+    for line in lines:
+        if line == '' or line.startswith('#'):
+            continue
+        exclude = not line.startswith('!')
+        pattern = os.path.normpath(line.lstrip('!').strip()).lstrip('/')
+        patterns.append((compile_dockerignore_pattern(pattern), exclude))
+    return patterns
+
+def is_ignored(path, patterns):
+    # like docker, a pattern also matches everything inside the directories it matches. the last matching pattern wins
+    parts = path.split('/')
+    prefixes = ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+    ignored = False
+    for regex, exclude in patterns:
+        if any(regex.match(p) for p in prefixes):
+            ignored = exclude
+    return ignored
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_inputs_digest(task, repo_dir='.'):
+    '''
+    digest of everything that goes into the image: the files of the context docker would send,
+    the dockerfile, the platforms and the labels from the task. the version and creation date
+    labels are left out, they change on every pipeline.
+    '''
+    context = os.path.join(repo_dir, task.get('context', '.'))
+    file = os.path.join(repo_dir, task.get('file', 'Dockerfile'))
+    patterns = load_dockerignore(context, file)
+    has_exceptions = any(not exclude for _, exclude in patterns)
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps({
+        'dockerfile': hash_file(file),
+        'platforms': task.get('platforms') or ['linux/amd64'],
+        'labels': task.get('labels'),
+    }, sort_keys=True).encode())
+    for root, dirs, files in os.walk(context):
+        dirs.sort()
+        relative_root = os.path.relpath(root, context).replace(os.sep, '/')
+        prefix = '' if relative_root == '.' else relative_root + '/'
+        # excluded directories can only be skipped when no pattern adds files back into them
+        if not has_exceptions:
+            dirs[:] = [d for d in dirs if os.path.islink(os.path.join(root, d)) or not is_ignored(prefix + d, patterns)]
+        for name in sorted(files + [d for d in dirs if os.path.islink(os.path.join(root, d))]):
+            path = os.path.join(root, name)
+            if is_ignored(prefix + name, patterns):
+                continue
+            if os.path.islink(path):
+                entry = f'link:{os.readlink(path)}'
+            else:
+                entry = f'{oct(os.stat(path).st_mode & 0o111)}:{hash_file(path)}'
+            digest.update(f'{prefix}{name}\0{entry}\n'.encode())
+    return digest.hexdigest()
+
+registry_credentials = {
+    'gitlab': ('GITLAB_CR_USERNAME', 'GITLAB_CR_PASSWORD'),
+    'docker-hub': ('DOCKER_HUB_USERNAME', 'DOCKER_HUB_PASSWORD'),
+}
+
+def find_published_image(task, env, digest):
+    '''
+    the first image in the task's registries built from the same inputs, or None. registries
+    that can't be reached are skipped, so the image is built as usual.
+    '''
+    # imported here since only tasks with `skip_unchanged` talk to registries
+    from .. import registry as container_registry
+    for registry in task.get('registries', []):
+        ref = f'{get_repository(registry, task["image"], env)}:{get_inputs_tag(digest)}'
+        username, password = [os.environ.get(v) for v in registry_credentials.get(registry, (None, None))]
+        try:
+            labels = container_registry.get_image_labels(ref, username, password)
+        except Exception as e:
+            print(f'could not look up {ref}: {type(e).__name__}: {e}', file=sys.stderr)
+            continue
+        if labels is not None and labels.get(inputs_label) == digest:
+            return ref
+    return None
+
+def resolve_inputs(task, env, repo_dir='.'):
+    if task.get('skip_unchanged') != True:
+        return
+    task['inputs_digest'] = get_inputs_digest(task, repo_dir)
+    published_image = find_published_image(task, env, task['inputs_digest'])
+    if published_image is not None:
+        task['published_image'] = published_image
@@ -1,36 +1,20 @@
 import yaml
 import os
+from ..rules import compile_auto_rules
 
-def should_use_manual_deploy(task, env):
-    auto_push_on = task.get('auto')
-    if auto_push_on is None:
-        return True
-
-    source = env['ROOT_PIPELINE_SOURCE']
-    branch = env.get('CI_COMMIT_BRANCH')
+def get_auto_rules(task, env):
+    return compile_auto_rules(task, env, ['source', 'branch'])
 
-    def check_entry(entry):
-        nonlocal source
-        nonlocal branch
-        if 'source' in entry:
-            if entry['source'] != source:
-                return False
-        if 'branch' in entry:
-            if entry['branch'] != branch:
-                return False
-        return True
-
-    for entry in auto_push_on:
-        if check_entry(entry):
-            return False
-    return True
+def should_use_manual_deploy(task, env):
+    return get_auto_rules(task, env).is_manual()
 
 def load_yaml(fn):
     with open(fn, 'r') as f:
         return yaml.safe_load(f)
 
-def get_projects(xtra):
-    data = load_yaml(xtra['changed_services_file'])
+def get_projects(xtra, cwd='.'):
+    # changes detected in the same process are passed in directly, see hephaestus.render_downstream
+    data = xtra.get('changed_services') or load_yaml(os.path.join(cwd, xtra['changed_services_file']))
     result = {}
     for project, body in data['projects'].items():
         existing_services = [k for k,v in body['services'].items() if v['status'] != 'removed']
@@ -66,7 +50,5 @@ def get_projects(xtra):
 
     return result
 
-def get_project_config(xtra, project):
-    if 'project_base_dir' in xtra:
-        return load_yaml(os.path.join(xtra['project_base_dir'], project, 'config.haondt.yml'))
-    return load_yaml(os.path.join(project, 'config.haondt.yml'))
+def get_project_config(xtra, project, cwd='.'):
+    return load_yaml(os.path.join(cwd, xtra.get('project_base_dir', ''), project, 'config.haondt.yml'))
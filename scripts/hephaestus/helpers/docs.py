@@ -0,0 +1,107 @@
+import hashlib, json, re, subprocess, sys
+
+renderers = {
+    'python': 'mkdocs',
+    'mkdocs': 'mkdocs',
+    'pelican': 'pelican',
+}
+
+def get_source_shape(source):
+    # sources can only share a matrix job if the template takes the same branches for all of them
+    return tuple(k for k in ['subpath', 'repository', 'sha', 'install'] if source.get(k))
+
+def get_cache_key(source):
+    # a source is only reused when it would be built from the same commit the same way
+    if not source.get('sha') or not source.get('subpath'):
+        return None
+    inputs = [source['sha'], source.get('install') or [], source.get('context') or '.', source.get('type'), source.get('path'), source.get('publishconf')]
+    digest = hashlib.sha256(json.dumps(inputs).encode('utf-8')).hexdigest()[:16]
+    return f'docs-{source["subpath"]}-{digest}'.replace('/', '-')
+
+def get_source_variables(source):
+    variables = {
+        'DOCS_SUBPATH': source.get('subpath'),
+        'DOCS_REF': source.get('ref'),
+        'DOCS_REPOSITORY': source.get('repository'),
+        'DOCS_CONTEXT': source.get('context') or '.',
+        'DOCS_INSTALL': ' '.join(source.get('install') or []),
+        'DOCS_PATH': source.get('path') or '.',
+        'DOCS_PUBLISHCONF': source.get('publishconf') or 'publishconf.py',
+    }
+    if source.get('sha'):
+        variables['DOCS_SHA'] = source['sha']
+        variables['DOCS_CACHE_KEY'] = get_cache_key(source)
+    return variables
+
+def get_build_groups(task):
+    '''
+    one build job per source. with `matrix` set, sources with the same renderer and shape are
+    collapsed into a parallel:matrix job, with the source fields passed as DOCS_* variables.
+    '''
+    grouped = {}
+    for source in task.get('sources', []):
+        renderer = renderers.get(source.get('type'))
+        if renderer is None:
+            continue
+        key = (renderer, get_source_shape(source)) if task.get('matrix') == True else (renderer, len(grouped))
+        grouped.setdefault(key, []).append(source)
+
+    groups = []
+    for (renderer, shape), sources in grouped.items():
+        if len(sources) == 1:
+            source = sources[0]
+            groups.append({
+                'name': f'{renderer}-docs-build-{source.get("subpath") or ""}-{source.get("ref") or ""}',
+                'renderer': renderer,
+                'source': source,
+                'cache_key': get_cache_key(source),
+                'matrix': None,
+            })
+            continue
+        groups.append({
+            'name': f'{renderer}-docs-build:' + '-'.join(shape or ('local',)),
+            'renderer': renderer,
+            'source': {
+                'subpath': '$DOCS_SUBPATH' if 'subpath' in shape else None,
+                'ref': '$DOCS_REF',
+                'sha': '$DOCS_SHA' if 'sha' in shape else None,
+                'repository': '$DOCS_REPOSITORY' if 'repository' in shape else None,
+                'context': '$DOCS_CONTEXT',
+                'install': ['$DOCS_INSTALL'] if 'install' in shape else [],
+                'path': '$DOCS_PATH',
+                'publishconf': '$DOCS_PUBLISHCONF',
+            },
+            'cache_key': '$DOCS_CACHE_KEY' if 'sha' in shape and 'subpath' in shape else None,
+            'matrix': [get_source_variables(s) for s in sources],
+        })
+    return groups
+
+def resolve_ref(repository, ref):
+    '''
+    the commit `ref` points to in `repository`, preferring branches over tags, or None if it
+    can't be resolved.
+    '''
+    if re.fullmatch(r'[0-9a-f]{40}', ref):
+        return ref
+    try:
+        output = subprocess.run(['git', 'ls-remote', repository, ref, f'{ref}^{{}}'], check=True, capture_output=True, text=True, timeout=60).stdout
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError) as e:
+        print(f'could not resolve {ref} in {repository}: {type(e).__name__}', file=sys.stderr)
+        return None
+    refs = dict(reversed(line.split('\t', 1)) for line in output.splitlines() if '\t' in line)
+    # annotated tags point to the tag object, the commit is on the peeled `^{}` entry
+    for name in [ref, f'refs/heads/{ref}', f'refs/tags/{ref}^{{}}', f'refs/tags/{ref}']:
+        if name in refs:
+            return refs[name]
+    return None
+
+def resolve_inputs(task, env, repo_dir='.'):
+    sources = [s for s in task.get('sources', []) if s.get('repository') and s.get('type') in renderers]
+    if len(sources) == 0:
+        return
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(8, len(sources))) as executor:
+        shas = list(executor.map(lambda s: resolve_ref(s['repository'], str(s.get('ref') or 'HEAD')), sources))
+    for source, sha in zip(sources, shas):
+        if sha is not None:
+            source['sha'] = sha
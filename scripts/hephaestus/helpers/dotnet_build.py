@@ -1,4 +1,7 @@
-from ..utils import try_get_version
+from ..utils import try_get_version, hash_files
+from ..rules import compile_auto_rules
+from xml.etree import ElementTree
+import os
 
 def get_version(env):
     commit_tag = env.get('CI_COMMIT_TAG')
@@ -9,19 +12,12 @@ def get_version(env):
         raise ValueError(f'commit tag `{commit_tag}` not in expected format')
     return version
 
-def should_use_manual_push(task, env):
-    auto_push_on = task.get('auto')
-    if auto_push_on is None:
-        return True
-
-    source = env['ROOT_PIPELINE_SOURCE']
-    for entry in auto_push_on:
-        if 'source' not in entry:
-            continue
-        if entry['source'] == source:
-            return False
+def get_auto_rules(task, env):
+    # only `source` is supported, these only run on tag pipelines
+    return compile_auto_rules(task, env, ['source'], ['source'])
 
-    return True
+def should_use_manual_push(task, env):
+    return get_auto_rules(task, env).is_manual()
 
 def get_job_discriminator(task):
     if 'name' in task:
@@ -35,3 +31,63 @@ def sanitize_csproj(path):
     if path.endswith('.csproj'):
         path = path[:-len('.csproj')]
     return path
+
+def get_package_discriminators(task):
+    return [sanitize_csproj(package['csproj']) for package in task.get('packages', [])]
+
+# files next to a project, or in a directory above it, that decide what its restore downloads
+restore_file_names = ['directory.packages.props', 'directory.build.props', 'directory.build.targets', 'nuget.config', 'global.json']
+
+def get_project_references(repo_dir, csproj):
+    try:
+        tree = ElementTree.parse(os.path.join(repo_dir, csproj))
+    except (OSError, ElementTree.ParseError):
+        return []
+    references = [e.get('Include') for e in tree.iter() if e.tag.split('}')[-1] == 'ProjectReference' and e.get('Include')]
+    return [os.path.normpath(os.path.join(os.path.dirname(csproj), r.replace('\\', '/'))) for r in references]
+
+def get_projects(task, repo_dir='.'):
+    # the task's packages and every project they reference
+    projects = []
+    pending = [os.path.normpath(p['csproj']) for p in task.get('packages', [])]
+    while len(pending) > 0:
+        project = pending.pop()
+        if project not in projects:
+            projects.append(project)
+            pending += get_project_references(repo_dir, project)
+    return projects
+
+def get_restore_files(task, repo_dir='.'):
+    files = set()
+    directories = set()
+    for project in get_projects(task, repo_dir):
+        files.add(project)
+        files.add(os.path.join(os.path.dirname(project), 'packages.lock.json'))
+        directory = os.path.dirname(project)
+        while not directory.startswith('..') and directory not in directories:
+            directories.add(directory)
+            if directory == '':
+                break
+            directory = os.path.dirname(directory)
+    for directory in directories:
+        try:
+            names = os.listdir(os.path.join(repo_dir, directory))
+        except OSError:
+            continue
+        files.update(os.path.join(directory, n) for n in names if n.lower() in restore_file_names)
+    return sorted(files)
+
+def get_cache(task):
+    # same scheme as the pip cache of python-build
+    fallback_key = f'dotnet-restore{get_job_discriminator(task)}'.replace(':', '-')
+    digest = task.get('restore_digest')
+    return {
+        'key': f'{fallback_key}-{digest[:16]}' if digest is not None else fallback_key,
+        'fallback_key': fallback_key,
+        'path': '.nuget/packages',
+    }
+
+def resolve_inputs(task, env, repo_dir='.'):
+    if task.get('shared_restore') != True:
+        return
+    task['restore_digest'] = hash_files(repo_dir, get_restore_files(task, repo_dir))
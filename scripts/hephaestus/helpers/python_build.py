@@ -1,4 +1,6 @@
-from ..utils import try_get_version
+from ..utils import try_get_version, hash_files
+from ..rules import compile_auto_rules
+import os, sys
 
 def get_version(env):
     commit_tag = env.get('CI_COMMIT_TAG')
@@ -9,21 +11,59 @@ def get_version(env):
         raise ValueError(f'commit tag `{commit_tag}` not in expected format')
     return version
 
-def should_use_manual_push(task, env):
-    auto_push_on = task.get('auto')
-    if auto_push_on is None:
-        return True
-
-    source = env['ROOT_PIPELINE_SOURCE']
-    for entry in auto_push_on:
-        if 'source' not in entry:
-            continue
-        if entry['source'] == source:
-            return False
+def get_auto_rules(task, env):
+    # only `source` is supported, these only run on tag pipelines
+    return compile_auto_rules(task, env, ['source'], ['source'])
 
-    return True
+def should_use_manual_push(task, env):
+    return get_auto_rules(task, env).is_manual()
 
 def get_job_discriminator(task):
     if 'name' in task:
         return f':{task["name"]}'
     return ''
+
+def get_packages(task):
+    # with `packages`, several packages are built in one job, sharing its cache
+    return task['packages'] if 'packages' in task else [task]
+
+def get_build_job_name(task):
+    packages = '+'.join(p['package'] for p in get_packages(task))
+    return f'python-build:{packages}{get_job_discriminator(task)}'
+
+def get_dist_dir(package):
+    context = os.path.normpath(package.get('context', '.'))
+    return 'dist' if context == '.' else f'{context}/dist'
+
+def get_dist_files(task):
+    return ' '.join(f'{get_dist_dir(p)}/*' for p in get_packages(task))
+
+def get_cache_files(task):
+    cache = task.get('cache')
+    if isinstance(cache, dict) and 'files' in cache:
+        return cache['files']
+    return [os.path.join(p.get('context', '.'), 'pyproject.toml') for p in get_packages(task)]
+
+def get_cache(task):
+    '''
+    the gitlab cache keys of the pip cache. the key is the hash of the cache files when the generate
+    job could read them, falling back to the caches of earlier hashes.
+    '''
+    if not task.get('cache'):
+        return None
+    fallback_key = get_build_job_name(task).replace(':', '-')
+    digest = task.get('cache_digest')
+    return {
+        'key': f'{fallback_key}-{digest[:16]}' if digest is not None else fallback_key,
+        'fallback_key': fallback_key,
+        'path': '.cache/pip',
+    }
+
+def resolve_inputs(task, env, repo_dir='.'):
+    if not task.get('cache'):
+        return
+    files = get_cache_files(task)
+    missing = [f for f in files if not os.path.isfile(os.path.join(repo_dir, f))]
+    if len(missing) > 0:
+        print(f'{get_build_job_name(task)}: cache files not found, left out of the cache key: {", ".join(missing)}', file=sys.stderr)
+    task['cache_digest'] = hash_files(repo_dir, files)
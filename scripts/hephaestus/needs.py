@@ -0,0 +1,172 @@
+reserved_keys = [
+    'default',
+    'include',
+    'stages',
+    'variables',
+    'workflow',
+    'image',
+    'services',
+    'cache',
+    'before_script',
+    'after_script',
+]
+
+needs_modes = ['report', 'stageless']
+
+def get_jobs(pipeline):
+    return { k: v for k, v in pipeline.items() if k not in reserved_keys and not k.startswith('.') and isinstance(v, dict) }
+
+def get_stages(pipeline):
+    stages = pipeline.get('stages') or ['build', 'test', 'deploy']
+    return ['.pre'] + [s for s in stages if s not in ['.pre', '.post']] + ['.post']
+
+def is_blocking(job):
+    # manual jobs outside of rules are allowed to fail, so they don't hold up later stages
+    if job.get('when') == 'manual':
+        return job.get('allow_failure', True) is False
+    return True
+
+def get_local_needs(job):
+    for need in job.get('needs', []):
+        if isinstance(need, str):
+            yield need
+        elif isinstance(need, dict) and 'job' in need and 'pipeline' not in need and 'project' not in need:
+            yield need['job']
+
+class NeedsGraph:
+    '''
+    Job dependency graph of a merged pipeline. Jobs with `needs` depend on the local jobs they list,
+    jobs without depend on every blocking job of the earlier stages, as gitlab would run them.
+    '''
+    def __init__(self, pipeline):
+        self.jobs = get_jobs(pipeline)
+        self.names = list(self.jobs.keys())
+        self.bits = { name: 1 << i for i, name in enumerate(self.names) }
+
+        stage_indices = { s: i for i, s in enumerate(get_stages(pipeline)) }
+        self.stages = { name: stage_indices.get(job.get('stage', 'test'), 0) for name, job in self.jobs.items() }
+
+        self.implicit: dict[str, bool] = {}
+        self.dependencies: dict[str, list[str]] = {}
+        for name, job in self.jobs.items():
+            if 'needs' in job:
+                self.implicit[name] = False
+                self.dependencies[name] = [n for n in get_local_needs(job) if n in self.jobs]
+            else:
+                self.implicit[name] = True
+                self.dependencies[name] = [n for n in self.names
+                    if self.stages[n] < self.stages[name] and is_blocking(self.jobs[n])]
+
+        self._ancestors: dict[str, int] = {}
+        self._depths: dict[str, tuple[int, str | None]] = {}
+        for name in self.names:
+            self._visit(name, set())
+
+    def _visit(self, name, visiting):
+        if name in self._ancestors:
+            return
+        if name in visiting:
+            raise ValueError(f'cycle in job dependencies at {name}, check that no job needs a job from a later stage')
+        visiting.add(name)
+        ancestors = 0
+        depth, previous = 1, None
+        for dependency in self.dependencies[name]:
+            self._visit(dependency, visiting)
+            ancestors |= self.bits[dependency] | self._ancestors[dependency]
+            if self._depths[dependency][0] + 1 > depth:
+                depth, previous = self._depths[dependency][0] + 1, dependency
+        visiting.remove(name)
+        self._ancestors[name] = ancestors
+        self._depths[name] = (depth, previous)
+
+    def minimal_needs(self, name):
+        dependencies = self.dependencies[name]
+        transitive = 0
+        for dependency in dependencies:
+            transitive |= self._ancestors[dependency]
+        return [d for d in dependencies if not self.bits[d] & transitive]
+
+    def critical_path(self):
+        if len(self.names) == 0:
+            return []
+        name = max(self.names, key=lambda n: self._depths[n][0])
+        path = []
+        while name is not None:
+            path.append(name)
+            name = self._depths[name][1]
+        return list(reversed(path))
+
+    def redundant_needs(self):
+        redundant = {}
+        for name in self.names:
+            minimal = self.minimal_needs(name)
+            if len(minimal) < len(self.dependencies[name]):
+                redundant[name] = [d for d in self.dependencies[name] if d not in minimal]
+        return redundant
+
+# gitlab rejects jobs that list more needs than this
+max_needs = 50
+
+def rewrite_stageless(pipeline, graph: NeedsGraph | None = None):
+    '''
+    Gives every job that relies on stage ordering an explicit `needs`, so the pipeline runs as a DAG.
+    Only the minimal set is needed for ordering, but jobs with `needs` only download artifacts from
+    the jobs they list, so earlier jobs with artifacts the job uses are kept as well. Jobs that use
+    artifacts of earlier manual jobs, which can't be needed without waiting for someone to run them,
+    or that would need more jobs than gitlab allows, keep running by stage. They are returned along
+    with the reason.
+    '''
+    # imported here, artifacts builds on this module
+    from .artifacts import get_artifact_paths, get_consumed_text, consumes, normalize_path
+    graph = graph or NeedsGraph(pipeline)
+    output = dict(pipeline)
+    staged = {}
+    for name, job in graph.jobs.items():
+        if not graph.implicit[name]:
+            continue
+        minimal = set(graph.minimal_needs(name))
+        allowed_artifacts = job.get('dependencies')
+        text = get_consumed_text(job)
+        uploads = [normalize_path(p) for p in get_artifact_paths(job) or []]
+
+        def uses_artifacts(producer):
+            paths = get_artifact_paths(graph.jobs[producer])
+            if paths is None:
+                return False
+            if allowed_artifacts is not None:
+                return producer in allowed_artifacts
+            return consumes(text, paths, uploads)
+
+        manual = [n for n in graph.names if graph.stages[n] < graph.stages[name] and not is_blocking(graph.jobs[n]) and uses_artifacts(n)]
+        if len(manual) > 0:
+            staged[name] = f'uses artifacts of manual jobs {", ".join(manual)}'
+            continue
+        needs = []
+        for dependency in graph.dependencies[name]:
+            has_artifacts = uses_artifacts(dependency)
+            if dependency in minimal or has_artifacts:
+                needs.append({ 'job': dependency, 'artifacts': has_artifacts })
+        if len(needs) > max_needs:
+            staged[name] = f'over the limit of {max_needs} needs'
+            continue
+        output[name] = { **job, 'needs': needs }
+    return output, staged
+
+def apply_needs_mode(pipeline, mode: str | None, header: dict):
+    if mode is None:
+        return pipeline
+    if mode not in needs_modes:
+        raise ValueError(f'unknown needs mode: {mode}')
+
+    graph = NeedsGraph(pipeline)
+    path = graph.critical_path()
+    header['critical path'] = f'{len(path)} jobs ({" -> ".join(path)})'
+    redundant = graph.redundant_needs()
+    header['redundant needs'] = sum(len(v) for k, v in redundant.items() if not graph.implicit[k])
+
+    if mode == 'stageless':
+        output, staged = rewrite_stageless(pipeline, graph)
+        if len(staged) > 0:
+            header['stage ordered jobs'] = f'{len(staged)} ({"; ".join(f"{k}: {v}" for k, v in staged.items())})'
+        return output
+    return pipeline
@@ -0,0 +1,91 @@
+import argparse, hashlib, json, os, shutil
+
+index_media_type = 'application/vnd.oci.image.index.v1+json'
+index_media_types = [index_media_type, 'application/vnd.docker.distribution.manifest.list.v2+json']
+# names of the layout entry, they don't apply to the manifests inside it
+layout_annotations = ['org.opencontainers.image.ref.name', 'io.containerd.image.name']
+
+def get_blob_path(layout: str, digest: str):
+    algorithm, encoded = digest.split(':', 1)
+    return os.path.join(layout, 'blobs', algorithm, encoded)
+
+def read_blob(layout: str, digest: str):
+    with open(get_blob_path(layout, digest), 'r') as f:
+        return json.load(f)
+
+def write_blob(layout: str, content: bytes):
+    digest = 'sha256:' + hashlib.sha256(content).hexdigest()
+    path = get_blob_path(layout, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return digest
+
+def read_layout_file(layout: str, name: str):
+    with open(os.path.join(layout, name), 'r') as f:
+        return json.load(f)
+
+def write_layout_file(layout: str, name: str, content):
+    with open(os.path.join(layout, name), 'w') as f:
+        json.dump(content, f)
+
+def copy_blobs(source: str, destination: str):
+    for root, _, files in os.walk(os.path.join(source, 'blobs')):
+        target_dir = os.path.join(destination, os.path.relpath(root, source))
+        os.makedirs(target_dir, exist_ok=True)
+        for f in files:
+            # blobs are content addressed, so one that exists is the same blob
+            if not os.path.exists(os.path.join(target_dir, f)):
+                shutil.copyfile(os.path.join(root, f), os.path.join(target_dir, f))
+
+def get_manifests(layout: str, descriptors):
+    # buildx writes a nested index when attestations are attached to the image
+    manifests = []
+    for descriptor in descriptors:
+        if descriptor.get('mediaType') in index_media_types:
+            manifests += get_manifests(layout, read_blob(layout, descriptor['digest'])['manifests'])
+        else:
+            manifests.append(descriptor)
+    return manifests
+
+def get_platform(layout: str, descriptor):
+    config = read_blob(layout, read_blob(layout, descriptor['digest'])['config']['digest'])
+    platform = { 'architecture': config['architecture'], 'os': config['os'] }
+    if 'variant' in config:
+        platform['variant'] = config['variant']
+    return platform
+
+def merge_layouts(output: str, layouts: list[str]):
+    '''
+    Merges the images of several oci layouts, e.g. one per platform, into a layout holding a single
+    manifest list, the same shape buildx writes for a multi-platform build.
+    '''
+    manifests = {}
+    for layout in layouts:
+        copy_blobs(layout, output)
+        for descriptor in get_manifests(layout, read_layout_file(layout, 'index.json')['manifests']):
+            descriptor = dict(descriptor)
+            annotations = { k: v for k, v in descriptor.pop('annotations', {}).items() if k not in layout_annotations }
+            if len(annotations) > 0:
+                descriptor['annotations'] = annotations
+            if 'platform' not in descriptor:
+                descriptor['platform'] = get_platform(layout, descriptor)
+            manifests.setdefault(descriptor['digest'], descriptor)
+
+    manifest_list = json.dumps({ 'schemaVersion': 2, 'mediaType': index_media_type, 'manifests': list(manifests.values()) }).encode()
+    digest = write_blob(output, manifest_list)
+    write_layout_file(output, 'oci-layout', { 'imageLayoutVersion': '1.0.0' })
+    write_layout_file(output, 'index.json', { 'schemaVersion': 2, 'mediaType': index_media_type, 'manifests': [
+        { 'mediaType': index_media_type, 'digest': digest, 'size': len(manifest_list) }
+    ]})
+    return digest
+
+def main():
+    parser = argparse.ArgumentParser(prog='oci', description='merge the images of several oci layouts into one multi-platform image')
+    parser.add_argument('layouts', nargs='+', help='oci layout directories')
+    parser.add_argument('-o', '--output', required=True, help='oci layout directory to write the merged image to')
+    args = parser.parse_args()
+    print(merge_layouts(args.output, args.layouts))
+
+if __name__ == '__main__':
+    main()
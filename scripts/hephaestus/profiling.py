@@ -0,0 +1,88 @@
+from contextlib import contextmanager, nullcontext
+from .environment import parse_bool_env_var
+import json, os, sys, time
+
+class Profiler:
+    '''
+    Collects wall time per phase and per task, along with cache and output statistics.
+    Phases that run more than once are accumulated.
+    '''
+    def __init__(self, name: str):
+        self.name = name
+        self.phases: dict[str, float] = {}
+        self.tasks: list[dict] = []
+        self.stats: dict[str, int | str] = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def add_stat(self, name: str, value: int | str):
+        if isinstance(value, int) and isinstance(self.stats.get(name), int):
+            value += self.stats[name]
+        self.stats[name] = value
+
+    def add_tasks(self, tasks: list[dict]):
+        self.tasks.extend(tasks)
+        for task in tasks:
+            for name in ['template_cache_hits', 'template_cache_misses']:
+                self.add_stat(name, task.get(name, 0))
+
+    def add_report(self, report: dict):
+        # timings measured in another process, e.g. by the render server
+        for name, seconds in report['phases'].items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+        self.tasks.extend(report['tasks'])
+        for name, value in report['stats'].items():
+            self.add_stat(name, value)
+
+    def report(self):
+        return {
+            'name': self.name,
+            'total': time.perf_counter() - self._start,
+            'phases': self.phases,
+            'tasks': self.tasks,
+            'stats': self.stats,
+        }
+
+    def summary(self, slowest: int = 5):
+        report = self.report()
+        lines = [f'{self.name} profile']
+        for name, seconds in report['phases'].items():
+            lines.append(f'  {name:<16} {seconds * 1000:>10.2f}ms')
+        lines.append(f'  {"total":<16} {report["total"] * 1000:>10.2f}ms')
+        if len(self.tasks) > 0:
+            lines.append(f'  slowest tasks (of {len(self.tasks)}):')
+            for task in sorted(self.tasks, key=lambda t: t['render'] + t['parse'], reverse=True)[:slowest]:
+                lines.append(f'    #{task["index"]:<4} {task["type"]:<28} render {task["render"] * 1000:>8.2f}ms  parse {task["parse"] * 1000:>8.2f}ms')
+        for name, value in self.stats.items():
+            lines.append(f'  {name}: {value}')
+        return '\n'.join(lines)
+
+    def write_report(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+def profile_phase(profiler: Profiler | None, name: str):
+    if profiler is None:
+        return nullcontext()
+    return profiler.phase(name)
+
+def get_profiler(name: str, enabled: bool = False, report_path: str | None = None):
+    report_path = report_path or os.environ.get('HEPHAESTUS_PROFILE_REPORT')
+    if enabled or report_path or parse_bool_env_var('HEPHAESTUS_PROFILE'):
+        return Profiler(name)
+    return None
+
+def finish_profiler(profiler: Profiler | None, report_path: str | None = None):
+    if profiler is None:
+        return
+    print(profiler.summary(), file=sys.stderr)
+    report_path = report_path or os.environ.get('HEPHAESTUS_PROFILE_REPORT')
+    if report_path:
+        profiler.write_report(report_path)
@@ -0,0 +1,114 @@
+import base64, json, re, urllib.error, urllib.parse, urllib.request
+
+manifest_media_types = [
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+]
+docker_hub_host = 'registry-1.docker.io'
+
+def parse_reference(ref: str):
+    '''
+    Splits `host/name:tag` into its parts. References without a registry host, like
+    `haumea/foo:latest`, are on docker hub.
+    '''
+    name, _, tag = ref.rpartition(':')
+    if '/' in tag or name == '':
+        name, tag = ref, 'latest'
+    first, _, rest = name.partition('/')
+    if rest != '' and ('.' in first or ':' in first or first == 'localhost'):
+        return first, rest, tag
+    return docker_hub_host, name if '/' in name else f'library/{name}', tag
+
+def get_scheme(host: str):
+    # local registries, e.g. a `registry:2` stand-in, don't serve tls
+    return 'http' if host.split(':')[0] in ['localhost', '127.0.0.1'] else 'https'
+
+class RegistryClient:
+    '''
+    Minimal client for the registry http api v2, with basic and bearer token auth.
+    '''
+    def __init__(self, host: str, username: str | None = None, password: str | None = None, timeout: float = 10):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.authorization = None
+
+    def _basic_authorization(self):
+        if self.username is None or self.password is None:
+            return None
+        return 'Basic ' + base64.b64encode(f'{self.username}:{self.password}'.encode()).decode()
+
+    def _authenticate(self, challenge: str):
+        scheme, _, params = challenge.partition(' ')
+        if scheme.lower() == 'basic':
+            return self._basic_authorization()
+        params = dict(re.findall(r'(\w+)="([^"]*)"', params))
+        query = urllib.parse.urlencode({ k: v for k, v in params.items() if k in ['service', 'scope'] })
+        request = urllib.request.Request(params['realm'] + ('?' + query if query else ''))
+        basic = self._basic_authorization()
+        if basic is not None:
+            request.add_unredirected_header('Authorization', basic)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            token = json.load(response)
+        return 'Bearer ' + (token.get('token') or token['access_token'])
+
+    def _open(self, path: str, accept: list[str] | None = None):
+        request = urllib.request.Request(f'{get_scheme(self.host)}://{self.host}/v2/{path}')
+        if accept is not None:
+            request.add_header('Accept', ', '.join(accept))
+        if self.authorization is not None:
+            # not sent along redirects, blobs are often served from storage that rejects it
+            request.add_unredirected_header('Authorization', self.authorization)
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def get(self, path: str, accept: list[str] | None = None):
+        '''
+        Returns the parsed json response, or None if it doesn't exist.
+        '''
+        try:
+            try:
+                with self._open(path, accept) as response:
+                    return json.load(response)
+            except urllib.error.HTTPError as e:
+                challenge = e.headers.get('WWW-Authenticate')
+                if e.code != 401 or challenge is None or self.authorization is not None:
+                    raise
+                self.authorization = self._authenticate(challenge)
+                with self._open(path, accept) as response:
+                    return json.load(response)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def get_manifest(self, name: str, reference: str):
+        return self.get(f'{name}/manifests/{reference}', manifest_media_types)
+
+    def get_blob(self, name: str, digest: str):
+        return self.get(f'{name}/blobs/{digest}')
+
+def get_image_labels(ref: str, username: str | None = None, password: str | None = None):
+    '''
+    Labels of the image `ref` points to, or None if it doesn't exist. For multi-platform images
+    the labels of the first platform are returned, they are the same for every platform.
+    '''
+    host, name, tag = parse_reference(ref)
+    client = RegistryClient(host, username, password)
+    manifest = client.get_manifest(name, tag)
+    if manifest is None:
+        return None
+    if 'manifests' in manifest:
+        # attestations are listed as unknown/unknown platforms
+        images = [m for m in manifest['manifests'] if m.get('platform', {}).get('os') != 'unknown']
+        if len(images) == 0:
+            return None
+        manifest = client.get_manifest(name, images[0]['digest'])
+        if manifest is None:
+            return None
+    config = client.get_blob(name, manifest['config']['digest'])
+    if config is None:
+        return None
+    return config.get('config', {}).get('Labels') or {}
@@ -0,0 +1,59 @@
+# kept free of heavy imports, the render client parses the same arguments without loading jinja
+from dataclasses import dataclass, asdict
+import os
+
+def add_render_arguments(parser, template_choices: list[str] | None = None):
+    parser.add_argument('task_index', help='index of task to render for')
+    parser.add_argument('template', help='template to render', choices=template_choices)
+    parser.add_argument('-x', '--xtra', action='append', help='extra args (key=value) to pass to the template renderer', type=str)
+    parser.add_argument('--templates', help='templates directory')
+    parser.add_argument('-f', '--file', help='pipeline file')
+    parser.add_argument('--cache', help='rendered template cache directory')
+    parser.add_argument('--format', default='yaml', choices=['yaml', 'json'], help='output format, json is also valid gitlab ci yaml')
+    add_needs_argument(parser)
+    add_dedupe_argument(parser)
+    add_artifacts_argument(parser)
+    add_profile_arguments(parser)
+
+def add_socket_argument(parser, help: str):
+    parser.add_argument('--socket', default=os.environ.get('HEPHAESTUS_SOCKET'), help=f'{help}, defaults to HEPHAESTUS_SOCKET')
+
+def add_needs_argument(parser):
+    parser.add_argument('--needs', choices=['report', 'stageless'], help='report the critical path of the rendered pipeline, or also rewrite it to run as a DAG using needs')
+
+def add_dedupe_argument(parser):
+    parser.add_argument('--dedupe', choices=['extends', 'verify'], help='hoist values repeated across jobs into hidden jobs used with extends, verify also checks that the result expands back to the original')
+
+def add_artifacts_argument(parser):
+    # read from the env as well, so child pipelines rendered by the generated jobs pick it up
+    parser.add_argument('--artifacts', choices=['report', 'minimal'], default=os.environ.get('HEPHAESTUS_ARTIFACTS') or None,
+        help='report how many artifact downloads could be skipped, or also limit each job to the artifacts its scripts use, defaults to HEPHAESTUS_ARTIFACTS')
+
+@dataclass(frozen=True)
+class OutputOptions:
+    '''
+    How a rendered pipeline is post-processed and written, see the `--format`, `--needs`,
+    `--dedupe` and `--artifacts` arguments.
+    '''
+    format: str = 'yaml'
+    needs: str | None = None
+    dedupe: str | None = None
+    artifacts: str | None = None
+
+    def to_dict(self):
+        return asdict(self)
+
+def get_output_options(args):
+    return OutputOptions(args.format, args.needs, args.dedupe, args.artifacts)
+
+def parse_xtra(pairs: list[str] | None):
+    xtra = {}
+    if pairs is not None:
+        for pair in pairs:
+            key, value = pair.split('=')
+            xtra[key] = value
+    return xtra
+
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', action='store_true', help='print phase and task timings to stderr, also enabled by HEPHAESTUS_PROFILE')
+    parser.add_argument('--profile-report', help='also write the timings as json to this file, defaults to HEPHAESTUS_PROFILE_REPORT')
@@ -0,0 +1,84 @@
+from .render_template import load_pipeline_config, render_pipeline, get_env, task_types
+from .render_cache import RenderCache, get_render_cache
+from .render_arguments import parse_xtra, add_needs_argument, add_dedupe_argument, add_artifacts_argument, OutputOptions, get_output_options
+import argparse, shlex, sys
+
+def get_spec_parser():
+    parser = argparse.ArgumentParser(prog='render-batch spec', exit_on_error=False)
+    parser.add_argument('task_index', help='index of task to render for')
+    parser.add_argument('template', help='template to render', choices=list(task_types.keys()))
+    parser.add_argument('-o', '--output', required=True, help='file to write the rendered pipeline to')
+    parser.add_argument('-x', '--xtra', action='append', help='extra args (key=value) to pass to the template renderer', type=str)
+    return parser
+
+def parse_specs(lines):
+    '''
+    one spec per line, in the same form as the render_template arguments plus an output file, e.g.
+    `3 docker-deploy-downstream-v2 -o project.yml -x changed_services_file=changed_services.yml`
+    '''
+    parser = get_spec_parser()
+    specs = []
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        try:
+            args = parser.parse_args(shlex.split(line))
+        except (argparse.ArgumentError, SystemExit) as e:
+            raise ValueError(f'invalid spec on line {line_number}: {line}') from e
+        specs.append({
+            'task_index': args.task_index,
+            'template': args.template,
+            'output': args.output,
+            'xtra': parse_xtra(args.xtra),
+        })
+    return specs
+
+def render_spec(data, spec, env, templates: str | None = None, cache: RenderCache | None = None, options: OutputOptions | None = None):
+    rendered = render_pipeline(data, spec['task_index'], spec['template'], spec['xtra'], env, templates=templates, cache=cache, options=options)
+    with open(spec['output'], 'w') as f:
+        f.write(rendered + '\n')
+    return spec['output'], cache
+
+def _render_spec_args(args):
+    return render_spec(*args)
+
+def render_specs(data, specs, env, templates: str | None = None, cache: RenderCache | None = None, options: OutputOptions | None = None, jobs: int = 1):
+    spec_args = [(data, spec, env, templates, cache.fork() if cache is not None else None, options) for spec in specs]
+    if jobs <= 1 or len(spec_args) <= 1:
+        results = [render_spec(*a) for a in spec_args]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(jobs, len(spec_args))) as executor:
+            results = list(executor.map(_render_spec_args, spec_args))
+
+    if cache is not None:
+        for _, spec_cache in results:
+            cache.join(spec_cache)
+    return [output for output, _ in results]
+
+def main():
+    parser = argparse.ArgumentParser(prog='render-batch')
+    parser.add_argument('specs', nargs='?', default='-', help='file with one render spec per line, defaults to stdin')
+    parser.add_argument('--templates', help='templates directory')
+    parser.add_argument('-f', '--file', help='pipeline file')
+    parser.add_argument('--cache', help='rendered template cache directory')
+    parser.add_argument('--format', default='yaml', choices=['yaml', 'json'], help='output format, json is also valid gitlab ci yaml')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes used to render specs')
+    add_needs_argument(parser)
+    add_dedupe_argument(parser)
+    add_artifacts_argument(parser)
+    args = parser.parse_args()
+
+    if args.specs == '-':
+        specs = parse_specs(sys.stdin.readlines())
+    else:
+        with open(args.specs, 'r') as f:
+            specs = parse_specs(f.readlines())
+
+    data = load_pipeline_config(args.file)
+    for output in render_specs(data, specs, get_env(), args.templates, get_render_cache(args.cache), get_output_options(args), args.jobs):
+        print(f'wrote {output}', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import hashlib, json, os, tempfile
+import functools
+
+class TrackedEnv(dict):
+    '''
+    Pipeline env that records which keys were looked up while rendering,
+    so that the cache can ignore values the output does not depend on.
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.accessed: set[str] = set()
+
+    def __getitem__(self, key):
+        self.accessed.add(key)
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self.accessed.add(key)
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        self.accessed.add(key)
+        return super().get(key, default)
+
+    def _access_all(self):
+        self.accessed.update(super().keys())
+
+    def __iter__(self):
+        self._access_all()
+        return super().__iter__()
+
+    def keys(self):
+        self._access_all()
+        return super().keys()
+
+    def values(self):
+        self._access_all()
+        return super().values()
+
+    def items(self):
+        self._access_all()
+        return super().items()
+
+    def copy(self):
+        self._access_all()
+        return dict(super().items())
+
+@functools.cache
+def get_code_checksum():
+    # helpers decide what the templates render, so a change to them has to invalidate the cache too
+    base_dir = os.path.dirname(__file__)
+    digest = hashlib.sha256()
+    for directory in [base_dir, os.path.join(base_dir, 'helpers')]:
+        for fn in sorted(os.listdir(directory)):
+            if fn.endswith('.py'):
+                with open(os.path.join(directory, fn), 'rb') as f:
+                    digest.update(fn.encode('utf-8'))
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+def _hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class RenderCache:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def fork(self):
+        return RenderCache(self.directory)
+
+    def join(self, other: 'RenderCache'):
+        self.hits += other.hits
+        self.misses += other.misses
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+    def describe(self):
+        return f'{self.hits} hits, {self.misses} misses ({self.hit_ratio:.0%} hit ratio)'
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def _read(self, key, suffix):
+        try:
+            with open(self._path(key, suffix), 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key, suffix, content):
+        path = self._path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, other workers may be reading the same entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _entry_key(self, base_key, env, dependencies):
+        return _hash([base_key, [[k, k in env, env.get(k)] for k in dependencies]])
+
+    def render(self, env, xtra, task, task_type, template_source, render):
+        base_key = _hash({
+            'task_type': task_type,
+            'task': task,
+            'xtra': xtra,
+            'template': template_source,
+            'code': get_code_checksum(),
+        })
+
+        manifest = self._read(base_key, '.deps.json')
+        if manifest is not None:
+            rendered = self._read(self._entry_key(base_key, env, json.loads(manifest)), '.yml')
+            if rendered is not None:
+                self.hits += 1
+                return rendered
+
+        self.misses += 1
+        tracked_env = TrackedEnv(env)
+        rendered = render(tracked_env)
+        dependencies = sorted(tracked_env.accessed)
+        self._write(base_key, '.deps.json', json.dumps(dependencies))
+        self._write(self._entry_key(base_key, env, dependencies), '.yml', rendered)
+        return rendered
+
+def get_render_cache(directory: str | None = None):
+    directory = directory or os.environ.get('HEPHAESTUS_RENDER_CACHE')
+    if not directory:
+        return None
+    return RenderCache(directory)
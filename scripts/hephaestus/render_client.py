@@ -0,0 +1,68 @@
+from .environment import get_env
+from .render_arguments import add_render_arguments, add_socket_argument, parse_xtra, OutputOptions, get_output_options
+from .profiling import Profiler, get_profiler, finish_profiler, profile_phase
+import argparse, json, os, socket, sys
+
+def request_render(socket_path: str, request: dict):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        s.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with s.makefile('rb') as f:
+            line = f.readline()
+    if len(line) == 0:
+        raise ConnectionError('render server closed the connection without replying')
+    return json.loads(line)
+
+def render_locally(request: dict, profiler: Profiler | None = None):
+    from .render_template import load_pipeline_config, render_pipeline
+    from .render_cache import RenderCache
+    with profile_phase(profiler, 'load config'):
+        data = load_pipeline_config(request['file'])
+    cache = RenderCache(request['cache']) if request['cache'] else None
+    return render_pipeline(data, request['task_index'], request['template'], request['xtra'], request['env'],
+        templates=request['templates'], cache=cache, options=OutputOptions(**request['options']), profiler=profiler)
+
+def main():
+    parser = argparse.ArgumentParser(prog='render-client')
+    add_render_arguments(parser)
+    add_socket_argument(parser, 'render server socket, rendering happens in process if it is not reachable')
+    args = parser.parse_args()
+    profiler = get_profiler('render_template', args.profile, args.profile_report)
+
+    request = {
+        'cwd': os.getcwd(),
+        'task_index': args.task_index,
+        'template': args.template,
+        'xtra': parse_xtra(args.xtra),
+        'templates': args.templates,
+        'file': args.file,
+        'cache': args.cache or os.environ.get('HEPHAESTUS_RENDER_CACHE'),
+        'options': get_output_options(args).to_dict(),
+        'env': get_env(),
+        'profile': profiler is not None,
+    }
+
+    if args.socket is None:
+        print(render_locally(request, profiler))
+        finish_profiler(profiler, args.profile_report)
+        return
+
+    try:
+        with profile_phase(profiler, 'request'):
+            response = request_render(args.socket, request)
+    except OSError:
+        print(f'render server at {args.socket} is not reachable, rendering in process', file=sys.stderr)
+        print(render_locally(request, profiler))
+        finish_profiler(profiler, args.profile_report)
+        return
+
+    if 'error' in response:
+        print(response['error'], file=sys.stderr)
+        sys.exit(1)
+    print(response['output'])
+    if profiler is not None and 'profile' in response:
+        profiler.add_report(response['profile'])
+    finish_profiler(profiler, args.profile_report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+from .render_template import load_pipeline_config, render_pipeline, get_env
+from .render_arguments import add_needs_argument, add_dedupe_argument, add_artifacts_argument, OutputOptions, get_output_options
+from dataclasses import asdict
+from enum import Enum
+import argparse, importlib, os, sys, yaml
+
+def get_deployer_module(name: str):
+    # the deployer lives next to hephaestus in the scripts directory, but its name isn't a valid identifier
+    return importlib.import_module(f'docker-deployer.{name}')
+
+def get_repo_changes(repo_dir: str):
+    get_changes = get_deployer_module('get_changes')
+    changed_paths, previous_commit = get_changes.get_changed_paths(repo_dir)
+    repo_map = get_changes.build_repo_map(repo_dir)
+    return get_changes.apply_file_changes(repo_dir, repo_map, changed_paths, previous_commit)
+
+def repo_changes_to_dict(repo_changes):
+    return asdict(repo_changes, dict_factory=lambda items: { k: v.value if isinstance(v, Enum) else v for k, v in items })
+
+def has_changes(changes):
+    for project in changes['projects'].values():
+        if project['status'] != 'unchanged':
+            return True
+        if any(service['status'] != 'unchanged' for service in project['services'].values()):
+            return True
+    return False
+
+def render_downstream(data, task_index, changes, changes_file: str, env, templates: str | None = None, options: OutputOptions | None = None):
+    options = options or OutputOptions()
+    if not has_changes(changes):
+        print('No changes detected', file=sys.stderr)
+        return render_pipeline(data, task_index, 'noop', {}, env, templates=templates, options=OutputOptions(options.format))
+    xtra = {
+        'project_base_dir': '.',
+        'changed_services_file': changes_file,
+        'changed_services': changes,
+    }
+    return render_pipeline(data, task_index, 'docker-deploy-downstream-v2', xtra, env, templates=templates, options=options)
+
+def main():
+    parser = argparse.ArgumentParser(prog='render-downstream', description='detect the changed services and render the downstream deploy pipeline in one process')
+    parser.add_argument('task_index', help='index of the docker-deploy-v2 task')
+    parser.add_argument('--repository', default='.', help='deployment repository')
+    parser.add_argument('--changes', default='changed_services.yml', help='file to write the detected changes to, for the downstream jobs')
+    parser.add_argument('--templates', help='templates directory')
+    parser.add_argument('-f', '--file', help='pipeline file')
+    parser.add_argument('--format', default='yaml', choices=['yaml', 'json'], help='output format, json is also valid gitlab ci yaml')
+    add_needs_argument(parser)
+    add_dedupe_argument(parser)
+    add_artifacts_argument(parser)
+    args = parser.parse_args()
+
+    repo_dir = os.path.realpath(args.repository)
+    repo_changes = get_repo_changes(repo_dir)
+    with open(args.changes, 'w') as f:
+        f.write(get_deployer_module('lib.dataclasses_tools').dataclass_to_yaml(repo_changes))
+    changes = repo_changes_to_dict(repo_changes)
+    print(yaml.safe_dump(get_deployer_module('get_pruned_changes').prune_changes(changes), sort_keys=False), file=sys.stderr)
+
+    data = load_pipeline_config(args.file)
+    print(render_downstream(data, args.task_index, changes, args.changes, get_env(), args.templates, get_output_options(args)))
+
+if __name__ == '__main__':
+    main()
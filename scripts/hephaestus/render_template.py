@@ -1,7 +1,16 @@
-import yaml, argparse
+import yaml, argparse, json
 from jinja2 import Environment, FileSystemLoader
 from .jinja2_extensions import setup_filters
-from .helpers import docker_build, python_build, docker_deploy, dotnet_build, docker_deploy_v2
+from .template_cache import get_template_cache
+from .render_cache import RenderCache, get_render_cache
+from .environment import get_env, get_public_env
+from .render_arguments import add_render_arguments, parse_xtra, OutputOptions, get_output_options
+from .needs import apply_needs_mode
+from .extends import apply_dedupe_mode
+from .artifacts import apply_artifacts_mode
+from .profiling import Profiler, get_profiler, finish_profiler, profile_phase
+from dataclasses import dataclass
+import importlib
 import os
 import functools
 
@@ -15,6 +24,7 @@ def get_images():
         'python': 'registry.gitlab.com/haondt/cicd/registry/python-builder:2.0.1',
         'docs': 'registry.gitlab.com/haondt/cicd/registry/docs-builder:1.0.4',
         'dotnet': 'registry.gitlab.com/haondt/cicd/registry/dotnet-builder:0.0.2',
+        'crane': 'gcr.io/go-containerregistry/crane/debug:v0.20.2',
     }
 
 def load_file(fn):
@@ -34,135 +44,142 @@ def load_yaml(fn):
     with open(fn, 'r') as f:
         return yaml.safe_load(f)
 
+# libyaml parses rendered templates several times faster, when pyyaml was built with it
+rendered_loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+def load_rendered(rendered: str):
+    return yaml.load(rendered, Loader=rendered_loader)
+
+def create_jinja(templates: str | None = None, template_cache: str | None = None):
+    env = Environment(
+        loader=FileSystemLoader(templates or 'templates'),
+        bytecode_cache=get_template_cache(template_cache))
+    setup_filters(env)
+    return env
+
 _jinja_env = None
 def get_jinja(templates: str | None = None):
     global _jinja_env
     if _jinja_env is None:
-        env = Environment(loader=FileSystemLoader(templates or 'templates'))
-        setup_filters(env)
-        _jinja_env = env
+        _jinja_env = create_jinja(templates)
     return _jinja_env
 
-_env: dict[str, str] | None = None
-def get_env():
-    global _env
-    if _env is None:
-        env = {}
-        def cpy(key):
-            nonlocal env
-            env[key] = os.environ[key]
-        def trycpy(key):
-            nonlocal env
-            if key in os.environ:
-                env[key] = os.environ[key]
-
-        cpy('GITLAB_CR_REGISTRY')
-        trycpy('DOCKER_HUB_REPOSITORY')
-
-        trycpy('CI_COMMIT_TAG')
-        trycpy('CI_COMMIT_BRANCH')
-        cpy('CI_COMMIT_SHORT_SHA')
-        cpy('ROOT_PIPELINE_SOURCE')
-        cpy('CI_PIPELINE_SOURCE')
-        trycpy('CI_RUNNER_HOSTING_TYPE')
-
-        env['DEFAULT_ARTIFACT_EXPIRY'] = '1 day'
-        trycpy('DEFAULT_ARTIFACT_EXPIRY')
-
-        _env = env
-
-    return _env
-
-def get_public_env():
-    private_env = get_env()
-    env = {}
-    for key in [
-        'GITLAB_CR_REGISTRY',
-        'DOCKER_HUB_REPOSITORY',
-        'CI_COMMIT_TAG',
-        'CI_COMMIT_BRANCH',
-        'CI_COMMIT_SHORT_SHA',
-        'ROOT_PIPELINE_SOURCE'
-        'CI_PIPELINE_SOURCE',
-        'DEFAULT_ARTIFACT_EXPIRY'
-        ]:
-        if key in private_env:
-            env[key] = private_env[key]
-    return env
+@dataclass(frozen=True)
+class TaskType:
+    template: str
+    # module in hephaestus.helpers, only imported once a task of this type is rendered
+    helpers: str | None = None
+    # which of task, env, images, xtra and cwd are passed to the template
+    context: tuple[str, ...] = ('task', 'env', 'images')
+    # false for templates that read files named in xtra, which the render cache cannot see
+    cacheable: bool = True
+    # function in `helpers` that reads the repository, or registries, before rendering. what it
+    # finds is stored on the task, so it is part of what the render cache is keyed on
+    resolve_inputs: str | None = None
+
+task_types = {
+    'docker-build': TaskType('docker-build.yml.jinja', 'docker_build', resolve_inputs='resolve_inputs'),
+    'python-build': TaskType('python-build.yml.jinja', 'python_build', resolve_inputs='resolve_inputs'),
+    'docker-deploy': TaskType('docker-deploy.yml.jinja', 'docker_deploy', ('task', 'env', 'images', 'xtra')),
+    'docker-deploy-downstream': TaskType('docker-deploy-downstream.yml.jinja', 'docker_deploy'),
+    'docker-deploy-v2': TaskType('docker-deploy-v2.yml.jinja', 'docker_deploy_v2', ('task', 'env', 'images', 'xtra')),
+    'docker-deploy-downstream-v2': TaskType('docker-deploy-downstream-v2.yml.jinja', 'docker_deploy_v2', ('task', 'env', 'images', 'xtra', 'cwd'), cacheable=False),
+    'docs': TaskType('docs.yml.jinja', 'docs', resolve_inputs='resolve_inputs'),
+    'dotnet-build': TaskType('dotnet-build.yml.jinja', 'dotnet_build', resolve_inputs='resolve_inputs'),
+    'noop': TaskType('noop.yml.jinja', context=()),
+}
+
+def get_task_type(task_type):
+    if task_type not in task_types:
+        raise ValueError(f"unknown task type: {task_type}")
+    return task_types[task_type]
 
-def render_template(env, xtra, task, task_type = None, templates: str | None = None):
-    task_type = task_type or task.get('type')
+@functools.cache
+def get_helpers(name: str):
+    return importlib.import_module(f'.helpers.{name}', __package__)
 
-    if task_type == 'docker-build':
-        template = get_jinja(templates).get_template('docker-build.yml.jinja')
-        return template.render(helpers=docker_build, task=task, env=env, images=get_images())
-    if task_type == 'python-build':
-        template = get_jinja(templates).get_template('python-build.yml.jinja')
-        return template.render(helpers=python_build, task=task, env=env, images=get_images())
-    if task_type == 'docker-deploy':
-        template = get_jinja(templates).get_template('docker-deploy.yml.jinja')
-        return template.render(helpers=docker_deploy, task=task, env=env, images=get_images(), xtra=xtra)
-    if task_type == 'docker-deploy-v2':
-        template = get_jinja(templates).get_template('docker-deploy-v2.yml.jinja')
-        return template.render(helpers=docker_deploy_v2, task=task, env=env, images=get_images(), xtra=xtra)
-    if task_type == 'noop':
-        template = get_jinja(templates).get_template('noop.yml.jinja')
-        return template.render()
-    if task_type == 'docker-deploy-downstream':
-        template = get_jinja(templates).get_template('docker-deploy-downstream.yml.jinja')
-        return template.render(helpers=docker_deploy, task=task, env=env, images=get_images())
-    if task_type == 'docker-deploy-downstream-v2':
-        template = get_jinja(templates).get_template('docker-deploy-downstream-v2.yml.jinja')
-        return template.render(helpers=docker_deploy_v2, task=task, env=env, images=get_images(), xtra=xtra)
-    if task_type == 'docs':
-        template = get_jinja(templates).get_template('docs.yml.jinja')
-        return template.render(task=task, env=env, images=get_images())
-    if task_type == 'dotnet-build':
-        template = get_jinja(templates).get_template('dotnet-build.yml.jinja')
-        return template.render(helpers=dotnet_build, task=task, env=env, images=get_images())
-    raise ValueError(f"unknown task type: {task_type}")
-
-def deduplicate_keys(yaml_data: str):
-    data = yaml.safe_load(yaml_data)
-    return yaml.dump(data)
+def render_template(env, xtra, task, task_type = None, templates: str | None = None, cache: RenderCache | None = None, cwd: str | None = None):
+    '''
+    `cwd` is the directory files named in xtra are relative to, defaults to the working directory.
+    '''
+    task_type = task_type or task.get('type')
+    definition = get_task_type(task_type)
+    if cache is None or not definition.cacheable:
+        return _render_template(env, xtra, task, definition, templates, cwd)
+
+    jinja = get_jinja(templates)
+    template_source, _, _ = jinja.loader.get_source(jinja, definition.template)
+    return cache.render(env, xtra, task, task_type, template_source,
+        lambda tracked_env: _render_template(tracked_env, xtra, task, definition, templates))
+
+def _render_template(env, xtra, task, definition: TaskType, templates: str | None = None, cwd: str | None = None):
+    template = get_jinja(templates).get_template(definition.template)
+    values = {
+        'task': task,
+        'env': env,
+        'images': get_images(),
+        'xtra': xtra,
+        'cwd': cwd or '.',
+    }
+    context = { k: values[k] for k in definition.context }
+    if definition.helpers is not None:
+        context['helpers'] = get_helpers(definition.helpers)
+    return template.render(**context)
+
+def dump_pipeline(data, output_format: str = 'yaml', header: dict | None = None):
+    header = header or {}
+    if output_format == 'json':
+        # json has no comments, gitlab ignores top level keys starting with a dot
+        if len(header) > 0:
+            data = { '.hephaestus-header': header, **data }
+        return json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    lines = [f'# {k}: {v}' for k, v in header.items()]
+    lines.append(yaml.safe_dump(data))
+    return '\n'.join(lines)
+
+def render_pipeline(data, task_index, template_name, xtra, env, *, templates: str | None = None, cache: RenderCache | None = None,
+        options: OutputOptions | None = None, profiler: Profiler | None = None, cwd: str | None = None):
+    options = options or OutputOptions()
+    task = data['tasks'][int(task_index)]
+    with profile_phase(profiler, 'render'):
+        rendered = render_template(env, xtra, task, template_name, templates, cache, cwd)
+
+    header = get_public_env(env)
+    if cache is not None:
+        header['render cache'] = cache.describe()
+    with profile_phase(profiler, 'parse'):
+        pipeline = load_rendered(rendered)
+    with profile_phase(profiler, 'artifacts'):
+        pipeline = apply_artifacts_mode(pipeline, options.artifacts, header)
+    with profile_phase(profiler, 'needs'):
+        pipeline = apply_needs_mode(pipeline, options.needs, header)
+    with profile_phase(profiler, 'dedupe'):
+        pipeline = apply_dedupe_mode(pipeline, options.dedupe, header)
+    with profile_phase(profiler, 'dump'):
+        output = dump_pipeline(pipeline, options.format, header)
+
+    if profiler is not None:
+        profiler.add_stat('output_bytes', len(output.encode('utf-8')))
+        template_cache = get_jinja(templates).bytecode_cache
+        if template_cache is not None:
+            profiler.add_stat('template_cache_hits', template_cache.hits)
+            profiler.add_stat('template_cache_misses', template_cache.misses)
+        if cache is not None:
+            profiler.add_stat('render_cache_hits', cache.hits)
+            profiler.add_stat('render_cache_misses', cache.misses)
+    return output
 
 def main():
     parser = argparse.ArgumentParser(prog='render-build')
-    parser.add_argument('task_index', help='index of task to render for')
-    parser.add_argument('template', help='template to render', choices=[
-        'docker-build',
-        'python-build',
-        'docker-deploy',
-        'docker-deploy-downstream',
-        'docker-deploy-v2',
-        'docker-deploy-downstream-v2',
-        'docs',
-        'noop'
-        ])
-    parser.add_argument('-x', '--xtra', action='append', help='extra args (key=value) to pass to the template renderer', type=str)
-    parser.add_argument('--templates', help='templates directory')
-    parser.add_argument('-f', '--file', help='pipeline file')
+    add_render_arguments(parser, list(task_types.keys()))
     args = parser.parse_args()
-    template_name = args.template
-    task_i = args.task_index
-    xtra = {}
-    if args.xtra is not None:
-        for pair in args.xtra:
-            key, value = pair.split('=')
-            xtra[key] = value
-
-    data = load_pipeline_config(args.file)
-    task = data['tasks'][int(task_i)]
-
-    env = get_env()
-    public_env = get_public_env()
-    for k, v in public_env.items():
-        print(f'# {k}: {v}')
-
-    rendered = render_template(env, xtra, task, template_name, args.templates)
-    dd_rendered = deduplicate_keys(rendered)
-
-    print(dd_rendered)
+
+    profiler = get_profiler('render_template', args.profile, args.profile_report)
+    with profile_phase(profiler, 'load config'):
+        data = load_pipeline_config(args.file)
+    print(render_pipeline(data, args.task_index, args.template, parse_xtra(args.xtra), get_env(),
+        templates=args.templates, cache=get_render_cache(args.cache), options=get_output_options(args), profiler=profiler))
+    finish_profiler(profiler, args.profile_report)
 
 if __name__ == '__main__':
     main()
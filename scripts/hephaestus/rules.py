@@ -0,0 +1,55 @@
+class AutoRules:
+    '''
+    Decision table for the `auto` entries of a task, built once against the pipeline env.
+    Entries that can never match the env are dropped up front, so deciding whether a
+    job is manual is a set lookup on whatever is left.
+    '''
+    def __init__(self, enabled: bool, always: bool = False, tag_sources: set[str] | None = None):
+        self.enabled = enabled
+        self.always = always
+        self.tag_sources = tag_sources or set()
+
+    def is_manual(self, tag_source: str | None = None):
+        if not self.enabled:
+            return True
+        if self.always:
+            return False
+        return tag_source not in self.tag_sources
+
+def compile_auto_rules(task, env, fields: list[str], required_fields: list[str] | None = None):
+    '''
+    fields are the entry keys the task type supports, any others are ignored.
+    entries missing one of required_fields never match.
+    '''
+    auto_on = task.get('auto')
+    if auto_on is None:
+        return AutoRules(False)
+
+    values = {
+        'source': env['ROOT_PIPELINE_SOURCE'],
+        'has_tag': 'CI_COMMIT_TAG' in env,
+        'branch': env.get('CI_COMMIT_BRANCH'),
+    }
+    required_fields = required_fields or []
+
+    def check_entry(entry):
+        for field in required_fields:
+            if field not in entry:
+                return False
+        for field in fields:
+            if field not in entry or field not in values:
+                continue
+            value = bool(entry[field]) if field == 'has_tag' else entry[field]
+            if value != values[field]:
+                return False
+        return True
+
+    rules = AutoRules(True)
+    for entry in auto_on:
+        if not check_entry(entry):
+            continue
+        if 'tag_source' in fields and 'tag_source' in entry:
+            rules.tag_sources.add(entry['tag_source'])
+        else:
+            rules.always = True
+    return rules
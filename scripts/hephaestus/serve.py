@@ -0,0 +1,102 @@
+from .render_template import load_pipeline_config, render_pipeline, get_jinja, get_helpers, task_types
+from .render_cache import RenderCache
+from .render_arguments import OutputOptions, add_socket_argument, add_profile_arguments
+from .profiling import Profiler, get_profiler, finish_profiler
+import socketserver, argparse, json, os, sys, traceback
+
+class RenderHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+            profiler = self.server.get_profiler(request)
+            response = { 'output': self.server.render(request, profiler) }
+            if request.get('profile'):
+                response['profile'] = profiler.report()
+            self.server.finish_profiler(profiler)
+        except Exception as e:
+            response = { 'error': ''.join(traceback.format_exception(e)) }
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+class RenderServer(socketserver.UnixStreamServer):
+    '''
+    Renders templates for clients over a unix socket, keeping the jinja environment,
+    helper modules and parsed pipeline files loaded between requests. Paths in a request are
+    relative to the client's working directory, which is sent along with it.
+    '''
+    def __init__(self, socket_path: str, templates: str | None = None, profile: bool = False, profile_report: str | None = None):
+        self.templates = os.path.realpath(templates or 'templates')
+        self.profile = profile
+        self.profile_report = profile_report
+        self._configs = {}
+        super().__init__(socket_path, RenderHandler)
+
+    def server_bind(self):
+        # requests carry a working directory and env to render with, so only our own user may connect
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def warm(self):
+        jinja = get_jinja(self.templates)
+        for task_type in task_types.values():
+            jinja.get_template(task_type.template)
+            if task_type.helpers is not None:
+                get_helpers(task_type.helpers)
+
+    def get_pipeline_config(self, file: str):
+        path = os.path.realpath(file)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        if path not in self._configs or self._configs[path][0] != version:
+            self._configs[path] = (version, load_pipeline_config(path))
+        return self._configs[path][1]
+
+    def get_profiler(self, request):
+        # clients ask for the timings of their own request, the server's flags profile every request
+        if request.get('profile'):
+            return Profiler('serve')
+        return get_profiler('serve', self.profile, self.profile_report)
+
+    def finish_profiler(self, profiler: Profiler | None):
+        if profiler is not None and (self.profile or self.profile_report is not None):
+            finish_profiler(profiler, self.profile_report)
+
+    def render(self, request, profiler: Profiler | None = None):
+        templates = request.get('templates')
+        if templates is not None and os.path.realpath(os.path.join(request['cwd'], templates)) != self.templates:
+            raise ValueError(f'server renders templates from {self.templates}, not {templates}')
+
+        cwd = request['cwd']
+        data = self.get_pipeline_config(os.path.join(cwd, request.get('file') or 'pipeline.yml'))
+        cache = RenderCache(os.path.join(cwd, request['cache'])) if request.get('cache') else None
+        return render_pipeline(data, request['task_index'], request['template'], request.get('xtra', {}), request['env'],
+            templates=self.templates, cache=cache, options=OutputOptions(**request.get('options', {})), profiler=profiler, cwd=cwd)
+
+def main():
+    parser = argparse.ArgumentParser(prog='serve')
+    add_socket_argument(parser, 'path of the unix socket to listen on')
+    parser.add_argument('--templates', help='templates directory')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    if args.socket is None:
+        parser.error('--socket or HEPHAESTUS_SOCKET is required')
+
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    with RenderServer(args.socket, args.templates, args.profile, args.profile_report) as server:
+        server.warm()
+        print(f'listening on {args.socket}', file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(args.socket)
+
+if __name__ == '__main__':
+    main()
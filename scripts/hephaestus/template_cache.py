@@ -0,0 +1,60 @@
+from jinja2.bccache import Bucket, FileSystemBytecodeCache
+import hashlib, argparse, os
+
+class SourceHashBytecodeCache(FileSystemBytecodeCache):
+    '''
+    Bytecode cache keyed on the template name and source rather than on its filename,
+    so a bundle compiled from one checkout of the templates stays valid for any other
+    checkout with the same contents.
+    '''
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(directory, pattern='%s.jinja.cache')
+        self.hits = 0
+        self.misses = 0
+
+    def load_bytecode(self, bucket):
+        super().load_bytecode(bucket)
+        if bucket.code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def get_bucket(self, environment, name, filename, source):
+        key = hashlib.sha256(f'{name}\0{source}'.encode('utf-8')).hexdigest()
+        bucket = Bucket(environment, key, self.get_source_checksum(source))
+        self.load_bytecode(bucket)
+        return bucket
+
+    def dump_bytecode(self, bucket):
+        # a bundle shipped in the image may be read-only, in which case we just don't persist
+        try:
+            super().dump_bytecode(bucket)
+        except OSError:
+            pass
+
+def get_template_cache(directory: str | None = None):
+    directory = directory or os.environ.get('HEPHAESTUS_TEMPLATE_CACHE')
+    if not directory:
+        return None
+    return SourceHashBytecodeCache(directory)
+
+def compile_templates(templates: str, directory: str):
+    from .render_template import create_jinja
+    env = create_jinja(templates, directory)
+    names = env.list_templates(extensions=['jinja'])
+    for name in names:
+        env.get_template(name)
+    return names
+
+def main():
+    parser = argparse.ArgumentParser(prog='template-cache')
+    parser.add_argument('output', help='directory to write the compiled templates to')
+    parser.add_argument('--templates', help='templates directory')
+    args = parser.parse_args()
+
+    for name in compile_templates(args.templates or 'templates', args.output):
+        print(f'compiled {name}')
+
+if __name__ == '__main__':
+    main()
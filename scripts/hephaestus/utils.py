@@ -1,4 +1,11 @@
 import re
+import functools
+import hashlib
+import os
+
+@functools.cache
+def compile_regex(pattern, flags=0):
+    return re.compile(pattern, flags=flags)
 
 def regex_ismatch(value='', pattern='', ignorecase=False):
     ''' Perform a `re.sub` returning a string '''
@@ -6,7 +13,7 @@ def regex_ismatch(value='', pattern='', ignorecase=False):
         flags = re.I
     else:
         flags = 0
-    _re = re.compile(pattern, flags=flags)
+    _re = compile_regex(pattern, flags)
     match = _re.match(value)
     return bool(match)
 
@@ -16,24 +23,36 @@ def try_get_version(tag: str):
         return None
     return tag[1:]
 
+def hash_files(repo_dir: str, files: list[str]):
+    # missing files are left out, so the digest changes once they are added
+    digest = hashlib.sha256()
+    for file in files:
+        path = os.path.join(repo_dir, file)
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            digest.update(os.path.normpath(file).encode('utf-8') + b'\0' + hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+def merge_list(l1, l2): #TODO: this should also verify relative ordering of steps
+    added = set()
+    l = []
+    def add_to_l(la):
+        nonlocal added
+        nonlocal l
+        for v in la:
+            if v not in added:
+                added.add(v)
+                l.append(v)
+    add_to_l(l1)
+    add_to_l(l2)
+    return l
+
 # deep merge two dictionaries created from yaml
 # when merging primitives, the one from d2 is preferred
 def deep_merge(d1, d2, conflicts="new", path=""):
     if conflicts not in ["new", "old", "err"]:
         raise ValueError("Unexpected conflict resolution:" + conflicts)
-    def merge_list(l1, l2): #TODO: this should also verify relative ordering of steps
-        added = set()
-        l = []
-        def add_to_l(la):
-            nonlocal added
-            nonlocal l
-            for v in la:
-                if v not in added:
-                    added.add(v)
-                    l.append(v)
-        add_to_l(l1)
-        add_to_l(l2)
-        return l
     result = d1.copy()
     for k, v in d2.items():
         if k not in result:
@@ -58,4 +77,33 @@ def deep_merge(d1, d2, conflicts="new", path=""):
             raise KeyError(f"Multiple entries found for key: {path}.{k}")
     return result
 
+# same as deep_merge, but merges d2 into d1 in place instead of copying d1.
+# values from d2 may end up shared with d1, so d2 should not be reused afterwards
+def deep_merge_into(d1, d2, conflicts="new", path=""):
+    if conflicts not in ["new", "old", "err"]:
+        raise ValueError("Unexpected conflict resolution:" + conflicts)
+    for k, v in d2.items():
+        if k not in d1:
+            d1[k] = v
+            continue
+        if type(v) != type(d1[k]):
+            if conflicts == "new":
+                d1[k] = v
+            elif conflicts == "err":
+                raise KeyError(f"Multiple entries found for key: {path}.{k}")
+            continue
+        if isinstance(v, dict):
+            deep_merge_into(d1[k], v, conflicts, path + "." + k)
+            continue
+        if isinstance(v, list):
+            d1[k][:] = merge_list(d1[k], v)
+            continue
+        if isinstance(v, tuple):
+            d1[k] = merge_list(d1[k], v)
+            continue
 
+        if conflicts == "new":
+            d1[k] = v
+        elif conflicts == "err":
+            raise KeyError(f"Multiple entries found for key: {path}.{k}")
+    return d1
@@ -0,0 +1,117 @@
+from .render_template import load_pipeline_config, get_env, get_jinja, get_task_type
+from .render_cache import RenderCache
+from .generate import render_task, get_task_env, merge_templates, render_noop, resolve_task_inputs
+from .changes import get_task_activations, make_manual
+from jinja2 import meta
+import copy, difflib, os, sys, time
+
+def get_template_names(jinja, name, seen=None):
+    # the template itself plus everything it includes, imports or extends
+    seen = seen if seen is not None else set()
+    if name in seen:
+        return seen
+    seen.add(name)
+    source, _, _ = jinja.loader.get_source(jinja, name)
+    for referenced in meta.find_referenced_templates(jinja.parse(source)):
+        if referenced is not None:
+            get_template_names(jinja, referenced, seen)
+    return seen
+
+def get_task_dependencies(jinja, task):
+    names = get_template_names(jinja, get_task_type(task.get('type')).template)
+    return { os.path.realpath(jinja.loader.get_source(jinja, n)[1]) for n in names }
+
+def get_mtimes(file: str, templates: str):
+    paths = [file]
+    for root, _, files in os.walk(templates):
+        paths += [os.path.join(root, f) for f in files]
+    mtimes = {}
+    for path in paths:
+        try:
+            mtimes[os.path.realpath(path)] = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            pass
+    return mtimes
+
+class PipelineWatcher:
+    '''
+    Keeps the rendered output of each task, along with the template files it was rendered from,
+    so a change only re-renders the tasks whose entry in the pipeline file or templates changed.
+    '''
+    def __init__(self, file: str | None = None, templates: str | None = None, cache: RenderCache | None = None):
+        self.file = os.path.realpath(file or 'pipeline.yml')
+        self.templates = templates or 'templates'
+        self.cache = cache
+        self.env = get_env()
+        self.tasks = []
+        self.activations = []
+        self.loaded = {}
+        self.dependencies = {}
+        # tasks that failed to render are retried on the next change
+        self.pending = set()
+
+    def update(self, changed: set[str]):
+        jinja = get_jinja(self.templates)
+        tasks = self.tasks
+        if self.file in changed or len(self.tasks) == 0:
+            tasks = load_pipeline_config(self.file).get('tasks', [])
+            self.activations = get_task_activations(tasks, self.env)
+            resolve_task_inputs(tasks, self.env, self.activations)
+
+        stale = []
+        for i, task in enumerate(tasks):
+            # the task count is part of every task's env, so adding or removing tasks re-renders all of them
+            if len(tasks) != len(self.tasks) or task != self.tasks[i] or i in self.pending or i not in self.loaded or self.dependencies[i] & changed:
+                stale.append(i)
+        self.tasks = tasks
+        self.loaded = { i: v for i, v in self.loaded.items() if i < len(tasks) }
+        self.pending = set(stale)
+
+        for i in stale:
+            if self.activations[i] == 'skip':
+                self.loaded.pop(i, None)
+                self.pending.discard(i)
+                continue
+            self.dependencies[i] = get_task_dependencies(jinja, tasks[i])
+            loaded, _, _ = render_task(get_task_env(self.env, i, len(tasks)), tasks[i], self.templates,
+                self.cache.fork() if self.cache is not None else None)
+            self.loaded[i] = make_manual(loaded) if self.activations[i] == 'manual' else loaded
+            self.pending.discard(i)
+
+        # merging reuses the values of the first docs it sees, the kept output must stay as rendered
+        loaded_templates = [copy.deepcopy(self.loaded[i]) for i in sorted(self.loaded)]
+        if len(loaded_templates) == 0 and 'skip' in self.activations:
+            loaded_templates = [render_noop(self.env, self.templates)]
+        return stale, merge_templates(loaded_templates)
+
+def watch_pipeline(file: str | None, templates: str | None, cache: RenderCache | None, finish, interval: float = 1.0):
+    '''
+    Renders the pipeline, then re-renders it whenever the pipeline file or templates change, printing
+    a diff against the previous output. `finish` turns the merged pipeline into the printed output.
+    '''
+    watcher = PipelineWatcher(file, templates, cache)
+    mtimes = {}
+    previous = None
+    try:
+        while True:
+            current = get_mtimes(watcher.file, watcher.templates)
+            changed = { p for p in set(current) | set(mtimes) if current.get(p) != mtimes.get(p) }
+            mtimes = current
+            if len(changed) > 0:
+                try:
+                    start = time.perf_counter()
+                    stale, pipeline = watcher.update(changed)
+                    output = finish(pipeline)
+                except Exception as e:
+                    print(f'{type(e).__name__}: {e}', file=sys.stderr)
+                else:
+                    if previous is None:
+                        print(output)
+                    else:
+                        sys.stdout.writelines(difflib.unified_diff(previous.splitlines(keepends=True), output.splitlines(keepends=True), 'previous', 'current'))
+                    print(f'rendered {len(stale)} of {len(watcher.tasks)} tasks in {(time.perf_counter() - start) * 1000:.0f}ms', file=sys.stderr)
+                    previous = output
+                sys.stdout.flush()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass